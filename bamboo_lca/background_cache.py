@@ -0,0 +1,156 @@
+from scipy import sparse
+import numpy as np
+import hashlib
+import shutil
+import json
+import os
+
+
+PARSER_VERSION = 1
+
+
+class BackgroundCache:
+    """
+    This class is used to cache parsed background databases on disk, so repeat imports are memory maps instead of text parsing.
+
+    Every entry is a directory named by its key, the key is built from the content hash of the source files, the chosen emissions and the parser version:
+
+        cache_dir/
+            <key>/
+                tech_data.npy, tech_indices.npy, tech_indptr.npy,
+                bio_data.npy, bio_indices.npy, bio_indptr.npy,
+                meta.json  (shapes, activity names, emission names)
+
+    The modification time of meta.json is used as the last access time, the least recently used entries are evicted when the directory grows above max_size.
+    """
+    def __init__(self, cache_dir: str, max_size: int = None):
+        """
+        Parameters:
+            * cache_dir: The directory to save the cache entries.
+            * max_size: The maximum size of the cache directory in bytes, by default the size is not bounded.
+        """
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _hash_file(self, file_path, block_size=1 << 20):
+        file_hash = hashlib.sha256()
+        with open(file_path, "rb") as file:
+            for block in iter(lambda: file.read(block_size), b""):
+                file_hash.update(block)
+
+        return file_hash.hexdigest()
+
+    def get_key(self, a_file_path: str, s_file_path: str, emissions: list) -> str:
+        """
+        Build the cache key of a background database.
+
+        Parameters:
+            * a_file_path: The path to the EXIOBASE A.txt file.
+            * s_file_path: The path to the EXIOBASE S.txt file.
+            * emissions: The list of emissions used for LCA calculation.
+        """
+        key_hash = hashlib.sha256()
+        key_hash.update(f"parser-{PARSER_VERSION}".encode())
+        key_hash.update(self._hash_file(a_file_path).encode())
+        key_hash.update(self._hash_file(s_file_path).encode())
+        key_hash.update(json.dumps(list(emissions)).encode())
+
+        return key_hash.hexdigest()
+
+    def load(self, key: str):
+        """
+        Load a cache entry with memory-mapped arrays.
+
+        Parameters:
+            * key: The cache key from get_key.
+
+        Returns:
+            * tuple | None: Return the CSR format technosphere, the CSR format biosphere and the list of activities if the entry exists, otherwise None.
+        """
+        entry_dir = os.path.join(self.cache_dir, key)
+        meta_file = os.path.join(entry_dir, "meta.json")
+        if not os.path.exists(meta_file):
+            return None
+
+        with open(meta_file, "r") as file:
+            meta = json.load(file)
+        if meta.get("parser_version") != PARSER_VERSION:
+            self.invalidate(key)
+            return None
+        os.utime(meta_file)  # mark as recently used
+
+        matrices = []
+        for name in ["tech", "bio"]:
+            data, indices, indptr = [np.load(os.path.join(entry_dir, f"{name}_{part}.npy"), mmap_mode="r") for part in ["data", "indices", "indptr"]]
+            matrices.append(sparse.csr_array((data, indices, indptr), shape=tuple(meta[f"{name}_shape"]), copy=False))
+
+        return matrices[0], matrices[1], meta["activities"]
+
+    def save(self, key: str, tech_matrix, bio_matrix, activities: list, emissions: list):
+        """
+        Save a parsed background database as a cache entry, then evict old entries if the cache is too large.
+
+        Parameters:
+            * key: The cache key from get_key.
+            * tech_matrix: The technosphere matrix in scipy sparse format.
+            * bio_matrix: The biosphere matrix in scipy sparse format.
+            * activities: The list of background activities.
+            * emissions: The list of emissions used for LCA calculation.
+        """
+        entry_dir = os.path.join(self.cache_dir, key)
+        tmp_dir = f"{entry_dir}.tmp-{os.getpid()}"
+        os.makedirs(tmp_dir, exist_ok=True)
+
+        meta = {"parser_version": PARSER_VERSION, "activities": list(activities), "emissions": list(emissions)}
+        for name, matrix in [("tech", tech_matrix), ("bio", bio_matrix)]:
+            matrix = sparse.csr_array(matrix)
+            np.save(os.path.join(tmp_dir, f"{name}_data.npy"), matrix.data)
+            np.save(os.path.join(tmp_dir, f"{name}_indices.npy"), matrix.indices)
+            np.save(os.path.join(tmp_dir, f"{name}_indptr.npy"), matrix.indptr)
+            meta[f"{name}_shape"] = list(matrix.shape)
+        with open(os.path.join(tmp_dir, "meta.json"), "w") as file:
+            json.dump(meta, file)
+
+        # another process may have written the same entry in the meantime, the content is identical, so its entry is used.
+        try:
+            os.replace(tmp_dir, entry_dir)
+        except OSError:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            if not os.path.exists(os.path.join(entry_dir, "meta.json")):
+                raise
+
+        self._evict(keep=key)
+
+    def invalidate(self, key: str = None):
+        """
+        Remove one cache entry, or all cache entries if key is None.
+        """
+        keys = [key] if key is not None else os.listdir(self.cache_dir)
+        for entry in keys:
+            shutil.rmtree(os.path.join(self.cache_dir, entry), ignore_errors=True)
+
+    def _entry_size(self, entry_dir):
+        return sum(os.path.getsize(os.path.join(entry_dir, file)) for file in os.listdir(entry_dir))
+
+    def _evict(self, keep: str = None):
+        """
+        Remove the least recently used entries until the cache directory fits in max_size.
+        """
+        if self.max_size is None:
+            return
+
+        entries = []
+        for entry in os.listdir(self.cache_dir):
+            meta_file = os.path.join(self.cache_dir, entry, "meta.json")
+            if os.path.exists(meta_file):
+                entries.append((os.path.getmtime(meta_file), entry, self._entry_size(os.path.join(self.cache_dir, entry))))
+
+        total_size = sum(size for _, _, size in entries)
+        for _, entry, size in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            if entry == keep:
+                continue
+            self.invalidate(entry)
+            total_size -= size
@@ -1,27 +1,54 @@
 import pandas as pd
 import numpy as np
 import bw2data as bd
+import hashlib
+import json
+import os
+from scipy import sparse
 from .utils import *
+from .background_cache import BackgroundCache
+from .instrumentation import instrumented
 
 
 class BackgroundImporter:
-    def build_tech_matrix(self, raw_tech: np.ndarray):
+    _method_cache = {}  # the loaded methods {(<project>, <method>): <cfs>}, shared by all importers of the process
+
+    @classmethod
+    def clear_method_cache(cls):
+        """
+        Clear the methods loaded in this process, call it after a method is registered again or edited.
+        """
+        cls._method_cache.clear()
+
+    @instrumented()
+    def build_tech_matrix(self, raw_tech):
         """
         Get technosphere matrix data:
             Calculate (I-A), then convert it into a totally positive matrix.
+            If raw_tech is a scipy sparse matrix, the result is built without densifying, otherwise the dense path is used.
 
         Parameters:
-            * raw_tech: Raw data in pandas dataframe format.
+            * raw_tech: Raw data in numpy matrix format or scipy sparse matrix format.
 
         Returns: 
-            * np.ndarray: Return the numpy matrix format technosphere.
+            * np.ndarray | sparse.csr_array: Return the numpy matrix format technosphere, or the CSR format technosphere if raw_tech is sparse.
         """
+        if sparse.issparse(raw_tech):
+            # -(I - A) with the diagonal flipped keeps A off the diagonal and holds (1 - A_ii) on the diagonal.
+            raw_tech = sparse.csr_array(raw_tech, dtype=float)
+            diagonal = raw_tech.diagonal()
+            tech_matrix = raw_tech - sparse.diags_array(diagonal, format="csr") + sparse.diags_array(1 - diagonal, format="csr")
+            tech_matrix.eliminate_zeros()
+
+            return tech_matrix
+
         identity_matrix = np.identity(len(raw_tech))
         tech_matrix = - (identity_matrix - raw_tech)
         np.fill_diagonal(tech_matrix, -tech_matrix.diagonal())
 
         return tech_matrix
 
+    @instrumented()
     def build_bio_matrix(self, bio_df, emissions) -> np.ndarray:
         """
         Get biosphere matrix data:
@@ -38,19 +65,89 @@ class BackgroundImporter:
 
         return bio_matrix
 
-    def _get_from_cfs(self, emission_df):
+    @instrumented()
+    def import_tech_matrix(self, a_file_path: str, delimiter: str = "\t", chunksize: int = 1000):
+        """
+        Get technosphere matrix data and activity names from EXIOBASE A.txt in a single streaming pass, without densifying.
+
+        Parameters:
+            * a_file_path: The path to the EXIOBASE A.txt file.
+            * delimiter: The separator of the file.
+            * chunksize: The number of rows parsed at a time.
+
+        Returns:
+            * tuple: Return the CSR format technosphere and the list of background activities.
+        """
+        activities, (rows, cols, values), shape = read_exiobase_a(a_file_path, delimiter, chunksize)
+        raw_tech = sparse.coo_array((values, (rows, cols)), shape=shape)
+
+        return self.build_tech_matrix(raw_tech), activities
+
+    @instrumented()
+    def import_bio_matrix(self, s_file_path: str, emissions: list, delimiter: str = "\t", chunksize: int = 1000):
+        """
+        Get biosphere matrix data for the chosen emissions from EXIOBASE S.txt in a single streaming pass, without densifying.
+
+        Parameters:
+            * s_file_path: The path to the EXIOBASE S.txt file.
+            * emissions: The list of emissions used for LCA calculation.
+            * delimiter: The separator of the file.
+            * chunksize: The number of rows parsed at a time.
+
+        Returns:
+            * sparse.csr_array: Return the CSR format biosphere, the rows follow the order of emissions.
+        """
+        (rows, cols, values), shape = read_exiobase_s(s_file_path, emissions, delimiter, chunksize)
+
+        return sparse.csr_array((values, (rows, cols)), shape=shape)
+
+    @instrumented()
+    def import_background(self, a_file_path: str, s_file_path: str, emissions: list, cache_dir: str = None, max_cache_size: int = None, delimiter: str = "\t"):
+        """
+        Get technosphere matrix, biosphere matrix and activity names of EXIOBASE, reusing the on-disk cache if cache_dir is set.
+
+        Parameters:
+            * a_file_path: The path to the EXIOBASE A.txt file.
+            * s_file_path: The path to the EXIOBASE S.txt file.
+            * emissions: The list of emissions used for LCA calculation.
+            * cache_dir: The directory of the background cache, by default no cache is used.
+            * max_cache_size: The maximum size of the cache directory in bytes.
+            * delimiter: The separator of the files.
+
+        Returns:
+            * tuple: Return the CSR format technosphere, the CSR format biosphere and the list of background activities.
+        """
+        if cache_dir is None:
+            tech_matrix, activities = self.import_tech_matrix(a_file_path, delimiter)
+            bio_matrix = self.import_bio_matrix(s_file_path, emissions, delimiter)
+            return tech_matrix, bio_matrix, activities
+
+        cache = BackgroundCache(cache_dir, max_cache_size)
+        key = cache.get_key(a_file_path, s_file_path, emissions)
+        cached = cache.load(key)
+        if cached is not None:
+            print(f"Background database loaded from cache {key[:12]}.")
+            return cached
+
+        tech_matrix, activities = self.import_tech_matrix(a_file_path, delimiter)
+        bio_matrix = self.import_bio_matrix(s_file_path, emissions, delimiter)
+        cache.save(key, tech_matrix, bio_matrix, activities, emissions)
+
+        return tech_matrix, bio_matrix, activities
+
+    def _get_from_cfs(self, emission_df, column_name: str = "CFs"):
         """
         Get the characterization factors (type: list) from characterization factor file in dataframe format.
 
         Parameters:
             * emission_df: The dataframe format of characterization factor file, provide characterization factor matrix raw data.
+            * column_name: The column of the characterization factor values.
             
         Returns:
             * list: Return the CFs as a list.
         """
-        column_name = "CFs"
         if column_name not in emission_df.columns:
-            print("The file doesn't have a 'CFs' column. Please add your characterization factor values to the 'CFs' column.")
+            print(f"The file doesn't have a '{column_name}' column. Please add your characterization factor values to the '{column_name}' column.")
         else:
             cf_df = emission_df[column_name]
             if not cf_df.isnull().any():
@@ -61,14 +158,59 @@ class BackgroundImporter:
                 emission_values = emission_df[column_name].to_list()
                 cf_missing = emission_df[emission_df[column_name].isnull()]["exiobase name"].to_list()
                 
-                print(f"{cf_missing} emission(s) don't have characterization factor values. Please complete your 'CFs' column.")
+                print(f"{cf_missing} emission(s) don't have characterization factor values. Please complete your '{column_name}' column.")
                 # print the founded CFs
                 # print(f"Emissions: \n{emission_names}")
                 # print(f"Characteriation factor values: \n{emission_values}")
 
         return None
 
-    def _get_from_code(self, emission_df, method, ecoinvent_name):
+    def _load_method(self, method: tuple) -> dict:
+        """
+        Load the characterization factors of a method once per process and project, see clear_method_cache if the method is edited.
+
+        Returns:
+            * dict: Return {<code>: <cf value>} for ecoinvent 3.9 (the method data has [database, code] keys), {<id>: <cf value>} for ecoinvent 3.11 (int keys).
+        """
+        key = (bd.projects.current, tuple(method))
+        if key not in self._method_cache:
+            method_data = bd.Method(method).load()  # method_data is a list of tuple
+            if len(method_data) and isinstance(method_data[0][0], (list, tuple)):  # for ecoinvent 3.9, the first element of the tuple is a two element list
+                self._method_cache[key] = {database_code[1]: cf_value for database_code, cf_value in method_data}
+            else:  # for ecoinvent 3.11, the first element of the tuple is an int value
+                self._method_cache[key] = {id: cf_value for id, cf_value in method_data}
+
+        return self._method_cache[key]
+
+    def _get_ids(self, codes: list, database_name: str, chunk_size: int = 500) -> dict:
+        """
+        Map the activity codes of a database to their ids with bulk queries, instead of one query per code.
+
+        Returns:
+            * dict: Return {<code>: <id>}, codes not found in the database are not included.
+        """
+        from bw2data.backends import ActivityDataset
+
+        codes = list(dict.fromkeys(codes))
+        ids = {}
+        for start in range(0, len(codes), chunk_size):  # SQLite limits the number of variables of one query
+            query = ActivityDataset.select(ActivityDataset.id, ActivityDataset.code).where(
+                (ActivityDataset.database == database_name) & ActivityDataset.code.in_(codes[start:start + chunk_size])
+            )
+            ids.update({row.code: row.id for row in query})
+
+        return ids
+
+    def _get_cf_cache_file(self, emission_df, method, ecoinvent_name, cache_dir):
+        """
+        Get the path of the persistent CF cache file, the key is built from the project, method, database and the hash of the mapping.
+        """
+        mapping_hash = hashlib.sha256(emission_df[["exiobase name", "brightway code"]].to_csv(index=False).encode()).hexdigest()
+        key = hashlib.sha256(json.dumps([bd.projects.current, list(method), ecoinvent_name, mapping_hash]).encode()).hexdigest()
+
+        return os.path.join(cache_dir, f"cf_{key}.json")
+
+    def _get_from_code(self, emission_df, method, ecoinvent_name, cache_dir: str = None):
         """
         Get the characterization factor values (type: list) through brightway by code.
 
@@ -76,62 +218,45 @@ class BackgroundImporter:
             * emission_df: The dataframe format of characterization factor file, provide characterization factor matrix raw data.
             * method: The selected method used for LCA calculation.
             * ecoinvent_name: The name of the ecoinvent database on user's device.
+            * cache_dir: The directory of the persistent CF cache, by default the CFs are only cached in memory.
 
         Returns:
             * list | None: A list of characterization factor (cf) values if found, otherwise None.
         """
+        method = tuple(method)
+        cache_file = self._get_cf_cache_file(emission_df, method, ecoinvent_name, cache_dir) if cache_dir is not None else None
+        if cache_file is not None and os.path.exists(cache_file):
+            with open(cache_file, "r") as file:
+                print("All characterization factors have been found.")
+                return json.load(file)["cf_values"]
 
-        emission_codes = emission_df["brightway code"].copy()
-        emission_names = emission_df["exiobase name"].copy()
-        code_name = pd.concat([emission_codes, emission_names], axis=1, ignore_index=True)
-        code_name.columns = ["code", "name"]
+        emission_codes = emission_df["brightway code"]
+        method_cfs = self._load_method(method)
+        if len(method_cfs) and isinstance(next(iter(method_cfs)), str):  # ecoinvent 3.9, the method is keyed by code
+            cf_values = emission_codes.map(method_cfs)
+        else:  # ecoinvent 3.11, the method is keyed by id
+            ids = self._get_ids(emission_codes.dropna().to_list(), ecoinvent_name)
+            cf_values = emission_codes.map(ids).map(method_cfs)
 
-        bw_method = bd.Method(method)
-        method_data = bw_method.load() # method_data is a list of tuple
+        missing = cf_values.isnull()
+        if missing.any():
+            code_name = dict(zip(emission_codes, emission_df["exiobase name"]))
+            missing_codes = emission_codes[missing].unique().tolist()
+            print(f"Characterization factor data incomplete, missing: {[(code_name[code], code) for code in missing_codes]}")
+            return None
 
-        if isinstance(method_data[0][0], list): # for ecoinvent 3.9, the first element of the tuple is a two element list
-            method_df = pd.DataFrame(method_data, columns=["database_code", "cf_value"])
-            method_df[["database", "code"]] = method_df["database_code"].to_list()
-            cf_selected = method_df[method_df["code"].isin(emission_codes)][["code", "cf_value"]].copy()
-            missing_codes = list(set(emission_codes.unique()) - set(cf_selected["code"]))
+        print("All characterization factors have been found.")
+        cf_values = cf_values.to_list()
+        if cache_file is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            with open(f"{cache_file}.tmp-{os.getpid()}", "w") as file:
+                json.dump({"method": list(method), "database": ecoinvent_name, "cf_values": cf_values}, file)
+            os.replace(f"{cache_file}.tmp-{os.getpid()}", cache_file)
 
-            code_name_cf_value = code_name.merge(cf_selected, on="code", how="left", suffixes=("_old", "_new"))
-            cf_values = code_name_cf_value["cf_value"]
-            if missing_codes:
-                emission_names = []
-                for missing_code in missing_codes:
-                    emission_names.append(emission_df[emission_df["brightway code"] == missing_code]["exiobase name"].to_list()[0])
-                print(f"Characterization factor data incomplete, missing: {list(zip(emission_names, missing_codes))}")
-            else:
-                print("All characterization factors have been found.")
-                return cf_values.to_list()
-        elif isinstance(method_data[0][0], int): # for ecoinvent 3.11, the first element of the tuple is an int value
-            method_df = pd.DataFrame(method_data, columns=["id", "cf_value"])
-            emissions = {}
-            for code in emission_codes:
-                emission = bd.Database(ecoinvent_name).get(code)
-                emissions[emission.id] = code  # create the mapping from id to code
-            ids = list(emissions.keys())
-            cf_selected = method_df[method_df["id"].isin(ids)][["id", "cf_value"]]
-            missing_ids = set(ids) - set(cf_selected["id"].to_list())
-            missing_codes = [emissions[key] for key in missing_ids if key in emissions]
-            emissions = pd.DataFrame(list(emissions.items()), columns=["id", "code"])
-
-            name_code_id = code_name.merge(emissions, how="left", on="code", suffixes=("_old", "_new"))
-            df_merged = name_code_id.merge(cf_selected, how="left", on="id", suffixes=("_old", "_new"))
-            matrix_values = df_merged["cf_value"]
-            if missing_codes:
-                emission_names = []
-                for missing_code in missing_codes:
-                    emission_names.append(emission_df[emission_df["brightway code"] == missing_code]["exiobase name"].to_list()[0])
-                print(f"Characterization factor data incomplete, missing: {list(zip(emission_names, missing_codes))}")
-            else:
-                print("All characterization factors have been found.")
-                return matrix_values.to_list()
-        
-        return None
+        return cf_values
 
-    def build_cf_matrix(self, emission_file: str, emission_list: list, biodb_name: str = None, method: tuple = None, source="cf") -> np.ndarray:
+    @instrumented()
+    def build_cf_matrix(self, emission_file: str, emission_list: list, biodb_name: str = None, method: tuple = None, source="cf", cache_dir: str = None) -> np.ndarray:
         """
         Get characterization factor matrix data.
 
@@ -141,11 +266,11 @@ class BackgroundImporter:
             * biodb_name: The name of the biosphere database on user's device.
             * method: The LCIA method used for LCA calculation.
             * source: define the data source, two options: "cf" or "code". Set to "cf", the function extract CFs from "cf value" column of the file, set to "code", the function extract CFs from "brightway code" column of the file.
+            * cache_dir: The directory of the persistent CF cache, only used when source is "code".
 
         Returns: 
             * np.ndarray | None: Return the numpy matrix format of characterization factor (cf) values if found, otherwise None.
         """
-        emission_df = pd.read_csv(emission_file, delimiter=",")
         emission_df = file_preprocessing(emission_file, ",", "exiobase name", emission_list)  # sorting the column order align with the desired order.
         
         if source == "cf":
@@ -156,7 +281,7 @@ class BackgroundImporter:
             else:
                 print("Failed to build matrix, there are CFs not found.")
         elif source == "code":
-            cf_values = self._get_from_code(emission_df, method, biodb_name)
+            cf_values = self._get_from_code(emission_df, method, biodb_name, cache_dir)
             if cf_values:
                 cf_matrix = np.diagflat(cf_values)
                 return cf_matrix
@@ -167,6 +292,42 @@ class BackgroundImporter:
             
         return None
     
+    @instrumented()
+    def build_cf_operator(self, emission_file: str, emission_list: list, methods: list, biodb_name: str = None, source="cf", cache_dir: str = None):
+        """
+        Build the characterization operator of many methods at once, the mapping file is read once.
+
+        Parameters:
+            * emission_file: The path to the file that needs to be processed. The file includes emission name and emission code column.
+            * emission_list: the list of emissions in foreground system
+            * methods: The list of CF columns of the file if source is "cf", for example ["CFs"], or the list of LCIA methods if source is "code".
+            * biodb_name: The name of the biosphere database on user's device.
+            * source: define the data source, two options: "cf" (default, like build_cf_matrix) or "code", see build_cf_matrix.
+            * cache_dir: The directory of the persistent CF cache, only used when source is "code".
+
+        Returns:
+            * sparse.csr_array | None: Return the methods x emissions matrix of characterization factor values (one row per method) if all are found, otherwise None.
+        """
+        if source not in ["cf", "code"]:
+            print('Please set the source to either "cf" or "code".')
+            return None
+        emission_df = file_preprocessing(emission_file, ",", "exiobase name", emission_list)  # sorting the column order align with the desired order.
+
+        cf_rows = []
+        for method in methods:
+            if source == "cf":
+                cf_values = self._get_from_cfs(emission_df, method)
+            else:
+                cf_values = self._get_from_code(emission_df, method, biodb_name, cache_dir)
+            if cf_values is None:
+                print(f"Failed to build operator, there are CFs not found for {method}.")
+                return None
+            cf_rows.append(cf_values)
+        cf_operator = sparse.csr_array(np.array(cf_rows, dtype=float).reshape(len(methods), len(emission_df)))
+        cf_operator.eliminate_zeros()
+
+        return cf_operator
+
     # TODO: if it's functional unit, then try to find it and set it to 1 -> Not use this function, it's ok for now.
     def _find_functional_unit(self, emission_code, missing_codes, cf_dict, codes):
         cf_matrix = []
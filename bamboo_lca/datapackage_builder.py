@@ -3,30 +3,52 @@ from scipy import sparse
 import pandas as pd
 import numpy as np
 from typing import List, Tuple, Any
+from .instrumentation import instrumented
+from .datapackage_store import DatapackageStore
 
 
 class DatapackageBuilder:
+    def _get_coo(self, matrix):
+        """
+        Get the non-zero coordinates and values of a dense or sparse matrix, in row-major order.
+        """
+        coo = sparse.coo_array(matrix)
+        coo.sum_duplicates()
+        coo.eliminate_zeros()
+
+        return coo.row, coo.col, coo.data
+
+    def _get_indices(self, rows, cols, row_offset=0, col_offset=0):
+        """
+        Fill the bw indices array from coordinate arrays.
+        """
+        indices = np.empty(len(rows), dtype=bwp.INDICES_DTYPE)
+        indices["row"] = rows + row_offset
+        indices["col"] = cols + col_offset
+
+        return indices
+
+    @instrumented()
     def prepare_dp_matrix(self, tech_matrix, bio_matrix, cf_matrix):
         """
         Transform matrices data to bw matrices data, ready for the datapackages.
+
+        Parameters:
+            * tech_matrix: The technosphere matrix in numpy or scipy sparse format.
+            * bio_matrix: The biosphere matrix in numpy or scipy sparse format.
+            * cf_matrix: The characterization factor matrix in numpy or scipy sparse format.
         """
-        tech_sparse = sparse.coo_array(tech_matrix)
-        tech_coors = np.column_stack(tech_sparse.nonzero())
-        
-        max_coor = tech_coors[np.argmax(np.sum(tech_coors, axis=1))]
-        tech_data = tech_sparse.data
-        tech_indices = np.array([tuple(coor) for coor in tech_coors], dtype=bwp.INDICES_DTYPE)
-        tech_flip = np.array([False if i[0] == i[1] else True for i in tech_indices])
-
-        bio_sparse = sparse.coo_array(bio_matrix)
-        bio_coors = np.column_stack(bio_sparse.nonzero())
-        bio_data = bio_sparse.data
-        bio_indices = np.array([tuple([coord[0] + max_coor[0] + 1, coord[1]]) for coord in bio_coors], dtype=bwp.INDICES_DTYPE)
-        
-        cf_sparse = sparse.coo_array(cf_matrix)
-        cf_coors = np.column_stack(cf_sparse.nonzero())
-        cf_data =  cf_sparse.data
-        cf_indices = np.array([tuple([coord[0] + max_coor[0] + 1, coord[1] + max_coor[1] + 1]) for coord in cf_coors], dtype=bwp.INDICES_DTYPE)
+        tech_size = tech_matrix.shape[0]
+
+        tech_rows, tech_cols, tech_data = self._get_coo(tech_matrix)
+        tech_indices = self._get_indices(tech_rows, tech_cols)
+        tech_flip = tech_rows != tech_cols
+
+        bio_rows, bio_cols, bio_data = self._get_coo(bio_matrix)
+        bio_indices = self._get_indices(bio_rows, bio_cols, row_offset=tech_size)
+
+        cf_rows, cf_cols, cf_data = self._get_coo(cf_matrix)
+        cf_indices = self._get_indices(cf_rows, cf_cols, row_offset=tech_size, col_offset=tech_size)
 
         return [
             (tech_data, tech_indices, tech_flip),
@@ -34,13 +56,20 @@ class DatapackageBuilder:
             (cf_data, cf_indices)
         ]
 
-    def prepare_datapackage(self, datapackage_data: List[Tuple[Any, ...]], uncertainty: list = None):
+    def _split_foreground(self, resource, foreground):
         """
-        Prepare datapackage for brightway LCA calculation.
+        Split a resource into its foreground part and its background part.
+        """
+        parts = []
+        for mask in [foreground, ~foreground]:
+            parts.append({name: (value[mask] if name.endswith("_array") and value is not None else value) for name, value in resource.items()})
 
-        Parameters:
-            * datapackage_data: A list of tuple includes all information to create a datapackage.
-            * uncertainty: The uncertainty for all matrices.
+        return [part for part in parts if len(part["data_array"]) > 0]
+
+    def _get_resources(self, datapackage_data: List[Tuple[Any, ...]], uncertainty: list = None, fg_num: int = None) -> list:
+        """
+        Get the resources of the datapackage, the keyword arguments of bwp add_persistent_vector.
+        If fg_num is given, the technosphere and biosphere are split into a foreground resource and a background resource.
         """
         tech_data, tech_indices, tech_flip = datapackage_data[0]
         bio_data, bio_indices = datapackage_data[1]
@@ -50,25 +79,54 @@ class DatapackageBuilder:
         else:
             tech_uncertainty, bio_uncertainty, cf_uncerainty = uncertainty[0], uncertainty[1], uncertainty[2]
 
-        dp = bwp.create_datapackage()
-        dp.add_persistent_vector(
+        tech_resource = dict(
             matrix='technosphere_matrix',
             indices_array=tech_indices,
             data_array=tech_data,
             flip_array=tech_flip,
             distributions_array=tech_uncertainty,
         )
-        dp.add_persistent_vector(
+        bio_resource = dict(
             matrix='biosphere_matrix',
             indices_array=bio_indices,
             data_array=bio_data,
             distributions_array=bio_uncertainty,
         )
-        dp.add_persistent_vector(
+        cf_resource = dict(
             matrix='characterization_matrix',
             indices_array=cf_indices,
             data_array=cf_data,
             distributions_array=cf_uncerainty,
         )
+        if fg_num is None:
+            return [tech_resource, bio_resource, cf_resource]
+
+        tech_foreground = (tech_indices["row"] < fg_num) | (tech_indices["col"] < fg_num)
+        bio_foreground = bio_indices["col"] < fg_num
+
+        return self._split_foreground(tech_resource, tech_foreground) + self._split_foreground(bio_resource, bio_foreground) + [cf_resource]
+
+    @instrumented()
+    def prepare_datapackage(self, datapackage_data: List[Tuple[Any, ...]], uncertainty: list = None, store_dir: str = None, fg_num: int = None):
+        """
+        Prepare datapackage for brightway LCA calculation.
+
+        Parameters:
+            * datapackage_data: A list of tuple includes all information to create a datapackage.
+            * uncertainty: The uncertainty for all matrices.
+            * store_dir: Set a directory to save the datapackage once on disk and load it with memory-mapped arrays, see DatapackageStore.
+                The same data always gives the same datapackage, which can be passed to other processes by its path (datapackage.fs.path).
+            * fg_num: The number of foreground activities, set it to save the foreground and the background in separate resources.
+                In the store, every array is saved once by its content, so the background indices, data and flip arrays are shared by the datapackages
+                of foreground systems with the same number of activities (the background indices are offset by fg_num), whatever their uncertainty,
+                and the background distributions arrays are only shared by datapackages with the same background uncertainty.
+        """
+        resources = self._get_resources(datapackage_data, uncertainty, fg_num)
+        if store_dir is not None:
+            return DatapackageStore(store_dir).get(resources)
+
+        dp = bwp.create_datapackage()
+        for resource in resources:
+            dp.add_persistent_vector(**resource)
 
-        return dp
\ No newline at end of file
+        return dp
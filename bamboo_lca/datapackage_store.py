@@ -0,0 +1,184 @@
+from bw_processing.io_helpers import generic_directory_filesystem
+from pathlib import Path
+import bw_processing as bwp
+import numpy as np
+import hashlib
+import shutil
+import json
+import os
+
+
+STORE_VERSION = 1
+
+
+class DatapackageStore:
+    """
+    This class is used to save datapackages once on disk and reopen them with memory-mapped arrays, so many jobs and Monte Carlo workers on one host share the same pages.
+
+    Every datapackage is saved as a bw_processing directory datapackage, named by its key, the key is the content hash of all its arrays.
+    Every array is also saved once by its content hash, the array files of the datapackages are hard links to them:
+
+        store_dir/
+            arrays/
+                <array hash>.npy
+            datapackages/
+                <key>/
+                    datapackage.json, <resource>.indices.npy, <resource>.data.npy, ...
+
+    So an array is only saved once, whatever the other arrays of its datapackage are: for example the indices, data and flip arrays of a background resource
+    are shared by datapackages which only differ in their uncertainty (distributions arrays), or in a foreground resource with the same number of activities.
+    If hard links are not supported, every datapackage has its own copy of the arrays.
+    """
+    def __init__(self, store_dir: str):
+        """
+        Parameters:
+            * store_dir: The directory to save the datapackages.
+        """
+        self.store_dir = store_dir
+        self.arrays_dir = os.path.join(store_dir, "arrays")
+        self.datapackages_dir = os.path.join(store_dir, "datapackages")
+        os.makedirs(self.arrays_dir, exist_ok=True)
+        os.makedirs(self.datapackages_dir, exist_ok=True)
+
+    def _hash_array(self, array) -> str:
+        array = np.ascontiguousarray(array)
+        array_hash = hashlib.sha256(f"{array.dtype.descr}{array.shape}".encode())
+        array_hash.update(array.reshape(-1).view(np.uint8))
+
+        return array_hash.hexdigest()
+
+    def _get_array_hashes(self, resources: list) -> list:
+        """
+        Get the content hash of every array of the resources, {<array name>: <hash>} per resource.
+        """
+        return [{name: self._hash_array(array) for name, array in resource.items() if name.endswith("_array") and array is not None} for resource in resources]
+
+    def get_key(self, resources: list, array_hashes: list = None) -> str:
+        """
+        Build the key of a datapackage.
+
+        Parameters:
+            * resources: The resources of the datapackage, the keyword arguments of bwp add_persistent_vector, see DatapackageBuilder._get_resources.
+            * array_hashes: The hashes from _get_array_hashes, computed here if not given.
+        """
+        array_hashes = self._get_array_hashes(resources) if array_hashes is None else array_hashes
+        content = [{"matrix": resource["matrix"], "arrays": hashes} for resource, hashes in zip(resources, array_hashes)]
+
+        return hashlib.sha256(json.dumps({"store_version": STORE_VERSION, "resources": content}, sort_keys=True).encode()).hexdigest()
+
+    def get_path(self, key: str) -> str:
+        return os.path.join(self.datapackages_dir, key)
+
+    def save(self, resources: list) -> str:
+        """
+        Save a datapackage if it is not in the store yet.
+
+        Parameters:
+            * resources: The resources of the datapackage, the keyword arguments of bwp add_persistent_vector, see DatapackageBuilder._get_resources.
+
+        Returns:
+            * str: Return the key of the datapackage.
+        """
+        array_hashes = self._get_array_hashes(resources)
+        key = self.get_key(resources, array_hashes)
+        entry_dir = self.get_path(key)
+        if os.path.exists(os.path.join(entry_dir, "datapackage.json")):
+            return key
+
+        tmp_dir = f"{entry_dir}.tmp-{os.getpid()}"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        dp = bwp.create_datapackage(fs=generic_directory_filesystem(dirpath=Path(tmp_dir)), name=key)
+        for resource in resources:
+            dp.add_persistent_vector(**resource)
+        dp.finalize_serialization()
+
+        # the resources are added in order, so the n-th group of the datapackage is the n-th resource.
+        groups = list(dict.fromkeys(resource["group"] for resource in dp.resources))
+        for resource in dp.resources:
+            array_hash = array_hashes[groups.index(resource["group"])][f"{resource['kind']}_array"]
+            self._link_array(os.path.join(tmp_dir, resource["path"]), array_hash)
+
+        # another process may have written the same datapackage in the meantime, the content is identical, so its entry is used.
+        try:
+            os.replace(tmp_dir, entry_dir)
+        except OSError:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            if not os.path.exists(os.path.join(entry_dir, "datapackage.json")):
+                raise
+
+        return key
+
+    def _link_array(self, file_path, array_hash):
+        """
+        Replace an array file by a hard link to the saved array with the same content, or save it if it is the first one.
+        """
+        array_file = os.path.join(self.arrays_dir, f"{array_hash}.npy")
+        try:
+            if os.path.exists(array_file):
+                tmp_file = f"{file_path}.tmp"
+                os.link(array_file, tmp_file)
+                os.replace(tmp_file, file_path)
+            else:
+                os.link(file_path, array_file)
+        except FileExistsError:  # saved by another process in the meantime
+            self._link_array(file_path, array_hash)
+        except OSError:
+            pass  # hard links are not supported, the datapackage keeps its own copy.
+
+    @staticmethod
+    def load(path: str, mmap_mode: str = "r"):
+        """
+        Load a datapackage of the store, or any bw_processing directory datapackage, with memory-mapped arrays.
+
+        Parameters:
+            * path: The directory of the datapackage.
+            * mmap_mode: The memory mapping mode of np.load, "r" by default, None to load the arrays in memory.
+
+        Returns:
+            * bwp.Datapackage: Return the datapackage.
+        """
+        path = os.fspath(path)
+        if not os.path.exists(os.path.join(path, "datapackage.json")):
+            raise ValueError(f"No datapackage found in {path}.")
+
+        dp = bwp.load_datapackage(generic_directory_filesystem(dirpath=Path(path)), proxy=True)
+        for i, resource in enumerate(dp.resources):
+            if resource.get("format") == "npy":
+                dp.data[i] = np.load(os.path.join(path, resource["path"]), mmap_mode=mmap_mode)
+
+        return dp
+
+    @staticmethod
+    def get_datapackage_path(datapackage):
+        """
+        Get the directory of a datapackage loaded with memory-mapped arrays by load, None for other datapackages.
+        """
+        path = getattr(getattr(datapackage, "fs", None), "path", None)
+        if path is None or not datapackage.data or not all(isinstance(array, np.memmap) for array in datapackage.data):
+            return None
+
+        return path
+
+    def get(self, resources: list, mmap_mode: str = "r"):
+        """
+        Get a datapackage from the store, it is saved first if it is not in the store yet.
+
+        Returns:
+            * bwp.Datapackage: Return the datapackage with memory-mapped arrays.
+        """
+        return self.load(self.get_path(self.save(resources)), mmap_mode)
+
+    def invalidate(self, key: str = None):
+        """
+        Remove one datapackage, or all datapackages if key is None, and the saved arrays which are not used by any datapackage anymore.
+        """
+        keys = [key] if key is not None else os.listdir(self.datapackages_dir)
+        for entry in keys:
+            shutil.rmtree(os.path.join(self.datapackages_dir, entry), ignore_errors=True)
+
+        for file_name in os.listdir(self.arrays_dir):
+            array_file = os.path.join(self.arrays_dir, file_name)
+            if os.stat(array_file).st_nlink <= 1:
+                os.remove(array_file)
+
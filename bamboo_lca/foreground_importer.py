@@ -1,9 +1,32 @@
+from scipy import sparse
 import pandas as pd
 import numpy as np
+from .instrumentation import instrumented
 
 
 class ForegroundImporter:
-    def extend_matrix(self, extend_data: pd.DataFrame, emissions: list, fg_activities: list, bg_activities: list):
+    def _get_index_map(self, names: list) -> dict:
+        """
+        Map names to their first position in the list, the same position list.index() returns.
+        """
+        index_map = {}
+        for i, name in enumerate(names):
+            index_map.setdefault(name, i)
+
+        return index_map
+
+    def _build_block(self, rows, cols, amounts, shape, sparse_output):
+        """
+        Build one block from coordinates, if a position is given several times, the last amount is kept.
+        """
+        block = pd.DataFrame({"row": rows, "col": cols, "amount": amounts}).drop_duplicates(subset=["row", "col"], keep="last")
+        block = sparse.csr_array((block["amount"].to_numpy(dtype=float), (block["row"].to_numpy(dtype=int), block["col"].to_numpy(dtype=int))), shape=shape)
+        block.eliminate_zeros()
+
+        return block if sparse_output else block.toarray()
+
+    @instrumented()
+    def extend_matrix(self, extend_data: pd.DataFrame, emissions: list, fg_activities: list, bg_activities: list, sparse_output: bool = False):
         """
         Concatenate foreground data to background data.
         
@@ -12,36 +35,57 @@ class ForegroundImporter:
             * emissions: The list of emissions.
             * fg_activities: The list of foreground activities.
             * bg_activities: The list of background activities.
+            * sparse_output: Set to True to return the matrices in CSR format, otherwise numpy format.
         """
-        fgbg = np.zeros([len(fg_activities), len(bg_activities)])
-        fgfg = np.zeros([len(fg_activities), len(fg_activities)])
-        bgfg = np.zeros([len(bg_activities), len(fg_activities)])
-        bifg = np.zeros([len(emissions), len(fg_activities)])
-
-        for index, row in extend_data.iterrows():
-            activity_name = row["Activity name"]
-            column_num = fg_activities.index(activity_name)
-
-            if row["Exchange type"] == "production":  # fgfg
-                row_num = fg_activities.index(row["Exchange name"])
-                fgfg[row_num][column_num] = row["Exchange amount"]
-            elif row["Exchange type"] == "technosphere": # bgfg
-                try:
-                    row_num = bg_activities.index(row["Exchange name"])
-                except ValueError:
-                    row_num = fg_activities.index(row["Exchange name"])
-                bgfg[row_num][column_num] = row["Exchange amount"]
-            elif row["Exchange type"] == "biosphere": # bifg
-                row_num = emissions.index(row["Exchange name"])
-                bifg[row_num][column_num] = row["Exchange amount"]
-
-        fgfg = np.nan_to_num(fgfg, nan=0)
-        bgfg = np.nan_to_num(bgfg, nan=0)
-        bifg = np.nan_to_num(bifg, nan=0)
+        fg_index = self._get_index_map(fg_activities)
+        bg_index = self._get_index_map(bg_activities)
+        emission_index = self._get_index_map(emissions)
+
+        exchange_types = extend_data["Exchange type"].to_numpy()
+        exchange_names = extend_data["Exchange name"]
+        amounts = np.nan_to_num(extend_data["Exchange amount"].to_numpy(dtype=float), nan=0)
+        cols = extend_data["Activity name"].map(fg_index)
+
+        production = exchange_types == "production"  # fgfg
+        technosphere = exchange_types == "technosphere"  # bgfg
+        biosphere = exchange_types == "biosphere"  # bifg
+        rows = pd.Series(np.nan, index=extend_data.index)
+        rows[production] = exchange_names[production].map(fg_index)
+        rows[technosphere] = exchange_names[technosphere].map(bg_index).fillna(exchange_names[technosphere].map(fg_index))
+        rows[biosphere] = exchange_names[biosphere].map(emission_index)
+
+        missing_activities = extend_data["Activity name"][cols.isnull()].unique().tolist()
+        missing_exchanges = exchange_names[rows.isnull() & (production | technosphere | biosphere)].unique().tolist()
+        if missing_activities or missing_exchanges:
+            raise ValueError(f"Unknown activity name(s): {missing_activities}, unknown exchange name(s): {missing_exchanges}")
+
+        fgbg = self._build_block([], [], [], (len(fg_activities), len(bg_activities)), sparse_output)
+        fgfg = self._build_block(rows[production], cols[production], amounts[production], (len(fg_activities), len(fg_activities)), sparse_output)
+        bgfg = self._build_block(rows[technosphere], cols[technosphere], amounts[technosphere], (len(bg_activities), len(fg_activities)), sparse_output)
+        bifg = self._build_block(rows[biosphere], cols[biosphere], amounts[biosphere], (len(emissions), len(fg_activities)), sparse_output)
 
         return fgbg, fgfg, bgfg, bifg
 
-    def concatenate_matrix(self, tech_matrix: pd.DataFrame, bio_matrix: pd.DataFrame, fgbg: np.ndarray, fgfg: np.ndarray, bgfg: np.ndarray, bifg: np.ndarray):
+    @instrumented()
+    def concatenate_matrix(self, tech_matrix, bio_matrix, fgbg, fgfg, bgfg, bifg):
+        """
+        Concatenate the foreground matrices to the background matrices, the foreground activities come first.
+        If any of the matrices is a scipy sparse matrix, the blocks are assembled in CSR format without dense intermediates.
+
+        Parameters:
+            * tech_matrix: The background technosphere matrix.
+            * bio_matrix: The background biosphere matrix.
+            * fgbg, fgfg, bgfg, bifg: The foreground matrices from extend_matrix.
+
+        Returns:
+            * tuple: Return the full technosphere matrix and the full biosphere matrix.
+        """
+        if any(sparse.issparse(matrix) for matrix in [tech_matrix, bio_matrix, fgbg, fgfg, bgfg, bifg]):
+            tech_matrix = sparse.block_array([[fgfg, fgbg], [bgfg, tech_matrix]], format="csr")
+            bio_matrix = sparse.hstack([bifg, bio_matrix], format="csr")
+
+            return tech_matrix, bio_matrix
+
         tech_matrix = np.concatenate((np.concatenate((fgfg, bgfg), axis=0), np.concatenate((fgbg, tech_matrix), axis=0)), axis=1)
         bio_matrix = np.concatenate((bifg, bio_matrix), axis=1)
 
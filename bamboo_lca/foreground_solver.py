@@ -0,0 +1,199 @@
+from scipy.sparse import linalg
+from scipy import sparse
+import pandas as pd
+import numpy as np
+from .technosphere_solver import TechnosphereSolver
+from .utils import get_manual_tech_matrix, sample_uncertainty
+
+
+class ForegroundSolver:
+    """
+    This class is used to recompute foreground systems against a fixed background, without solving the full system again.
+
+    With the foreground activities first (the order of ForegroundImporter.concatenate_matrix), the system (I-A) x = f is split into blocks:
+
+        [ M_ff  M_fb ] [x_f]   [f_f]
+        [ M_bf  M_bb ] [x_b] = [f_b]
+
+    M_bb (the background) is factorized once, and the characterized background responses g = M_bb^-T (C B_bg)^T 1 are computed with one transposed solve.
+    A foreground edit then only needs the small Schur complement system S = M_ff - M_fb M_bb^-1 M_bf:
+
+        x_f = S^-1 (f_f - M_fb M_bb^-1 f_b)
+        score = (h_f - g M_bf) x_f + g f_b,    where h_f = 1^T C B_fg.
+
+    M_fb (fgbg) is normally all zeros, then S = M_ff. Otherwise Z = M_fb M_bb^-1 is computed once for every fgbg.
+    With a characterization operator of many methods, h_f and g have one row per method, and all scores come from the same solves.
+    """
+    def __init__(self, tech_matrix, bio_matrix, cf_matrix, backend: str = "superlu", methods: list = None):
+        """
+        Parameters:
+            * tech_matrix: The background technosphere matrix from BackgroundImporter (totally positive format).
+            * bio_matrix: The background biosphere matrix.
+            * cf_matrix: The characterization factor matrix.
+            * backend: The sparse LU backend of the background, see TechnosphereSolver.
+            * methods: Set the method names if cf_matrix is a characterization operator from BackgroundImporter.build_cf_operator (one row per method).
+        """
+        self.background = TechnosphereSolver(get_manual_tech_matrix(sparse.csr_array(tech_matrix)), backend)
+        self.cf_matrix = sparse.csr_array(cf_matrix)
+        self.methods = methods
+        characterized = self._characterize(sparse.csr_array(bio_matrix))
+        self.g = self.background.solve_transposed(characterized.T).reshape(-1, len(characterized))
+        self.num_bg = self.background.matrix.shape[0]
+        self._fgbg = None
+        self._z = None
+        self.blocks = None
+
+    def _characterize(self, bio_matrix):
+        """
+        Get the characterized biosphere, one row per method (1^T C B if there is only one characterization factor matrix).
+        """
+        characterized = self.cf_matrix @ bio_matrix
+        if self.methods is None:
+            return np.asarray(characterized.sum(axis=0)).reshape(1, -1)
+
+        return sparse.csr_array(characterized).toarray()
+
+    def _get_result(self, scores):
+        """
+        Return a float (one characterization factor matrix) or a pd.Series of the scores of every method.
+        """
+        if self.methods is None:
+            return float(scores[0])
+
+        return pd.Series(scores, index=self.methods, name="score")
+
+    def _get_z(self, fgbg):
+        """
+        Get Z = M_fb M_bb^-1 (None if fgbg is all zeros), Z is only recomputed when fgbg changes.
+        """
+        fgbg = sparse.csr_array(fgbg, dtype=float)
+        fgbg.eliminate_zeros()
+        if fgbg.nnz == 0:
+            self._fgbg, self._z = fgbg, None
+        elif self._fgbg is None or self._fgbg.shape != fgbg.shape or (self._fgbg != fgbg).nnz > 0:
+            self._fgbg = fgbg
+            self._z = -self.background.solve_transposed(fgbg.T.toarray()).T
+
+        return self._z
+
+    def set_foreground(self, fgbg, fgfg, bgfg, bifg):
+        """
+        Set the foreground system, the background factorization is reused.
+
+        Parameters:
+            * fgbg, fgfg, bgfg, bifg: The foreground matrices from ForegroundImporter.extend_matrix, in numpy or scipy sparse format.
+        """
+        self.blocks = {name: self._get_block(block) for name, block in [("fgfg", fgfg), ("bgfg", bgfg), ("bifg", bifg)]}
+        self.blocks["z"] = self._get_z(fgbg)
+        self.num_fg = self.blocks["fgfg"].shape[0]
+        self._schur, self._weights = self._factorize(self.blocks["fgfg"], self.blocks["bgfg"], self.blocks["bifg"])
+
+    def _get_block(self, block):
+        block = sparse.csr_array(block, dtype=float)
+        block.eliminate_zeros()
+        block.sort_indices()
+
+        return block
+
+    def _factorize(self, fgfg, bgfg, bifg):
+        """
+        Factorize the Schur complement and get the weights (h_f - g M_bf) of the foreground scaling vector.
+        """
+        # M_bf is an off-diagonal block of (I-A), so its sign is changed like in get_manual_tech_matrix.
+        m_bf = -bgfg
+        m_ff = get_manual_tech_matrix(fgfg)
+        schur = m_ff if self.blocks["z"] is None else m_ff - self.blocks["z"] @ m_bf
+        h_f = self._characterize(bifg)
+
+        return linalg.splu(sparse.csc_array(schur)), h_f - (m_bf.T @ self.g).T
+
+    def _get_demand(self, demand):
+        """
+        Split the demand into the foreground and background parts, demand is an index or a full-system vector.
+        """
+        if np.isscalar(demand):
+            full = np.zeros(self.num_fg + self.num_bg)
+            full[demand] = 1
+            demand = full
+        demand = np.asarray(demand, dtype=float)
+
+        return demand[:self.num_fg], demand[self.num_fg:]
+
+    def score(self, demand):
+        """
+        Calculate the lca score, the same score as LCAWrapper.manual_lca of the full system.
+
+        Parameters:
+            * demand: The index of the functional unit (in the full system, the foreground activities come first), or the demand vector of the full system.
+
+        Returns:
+            * float | pd.Series: Return the lca score, or the lca score of every method if methods is set.
+        """
+        if self.blocks is None:
+            raise ValueError("No foreground system, please call set_foreground first.")
+        f_f, f_b = self._get_demand(demand)
+        if self.blocks["z"] is not None:
+            f_f = f_f - self.blocks["z"] @ f_b
+        x_f = self._schur.solve(f_f)
+
+        return self._get_result(self._weights @ x_f + f_b @ self.g)
+
+    def scores(self):
+        """
+        Calculate the lca score of one unit of every foreground activity, with one transposed solve of the Schur complement.
+
+        Returns:
+            * np.ndarray: Return the scores in the order of the foreground activities (one column per method if methods is set).
+        """
+        if self.blocks is None:
+            raise ValueError("No foreground system, please call set_foreground first.")
+        scores = self._schur.solve(np.ascontiguousarray(self._weights.T), trans="T")
+
+        return scores[:, 0] if self.methods is None else scores
+
+    def run(self, demand, iterations: int, uncertainty: dict, seed=None):
+        """
+        Perform Monte Carlo simulation with uncertainty on the foreground matrices, only the Schur complement is solved in every iteration.
+
+        Parameters:
+            * demand: The index of the functional unit, or the demand vector of the full system.
+            * iterations: The number of iterations.
+            * uncertainty: The uncertainty arrays of the foreground matrices {"fgfg" | "bgfg" | "bifg": array}, every array (bwp.UNCERTAINTY_DTYPE)
+                has one row per stored value of the matrix, in CSR order (the order of matrix.data),
+                for example UncertaintyHandler().add_uniform_uncertainty(2, 1.106, False, matrix.data).
+            * seed: The seed of the random number generator.
+
+        Returns:
+            * np.ndarray: Return the lca score of every iteration (one column per method if methods is set).
+        """
+        if self.blocks is None:
+            raise ValueError("No foreground system, please call set_foreground first.")
+        unsupported = [name for name in uncertainty if name not in ["fgfg", "bgfg", "bifg"]]
+        if unsupported:
+            raise ValueError(f"Matrix {unsupported} is not supported, only the foreground matrices fgfg, bgfg and bifg are supported.")
+
+        rng = np.random.default_rng(seed)
+        samples = {}
+        for name, params in uncertainty.items():
+            if len(params) != self.blocks[name].nnz:
+                raise ValueError(f"The uncertainty array of {name} has {len(params)} rows, but the matrix has {self.blocks[name].nnz} stored values.")
+            samples[name] = sample_uncertainty(params, rng.random((iterations, len(params))))
+
+        f_f, f_b = self._get_demand(demand)
+        if self.blocks["z"] is not None:
+            f_f = f_f - self.blocks["z"] @ f_b
+        background_score = f_b @ self.g
+
+        scores = np.empty((iterations, self.g.shape[1]))
+        for i in range(iterations):
+            blocks = []
+            for name in ["fgfg", "bgfg", "bifg"]:
+                block = self.blocks[name]
+                if name in samples:
+                    block = block.copy()
+                    block.data = samples[name][i]
+                blocks.append(block)
+            schur, weights = self._factorize(*blocks)
+            scores[i] = weights @ schur.solve(f_f) + background_score
+
+        return scores[:, 0] if self.methods is None else scores
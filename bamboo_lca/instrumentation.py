@@ -0,0 +1,284 @@
+from contextlib import contextmanager
+from scipy import sparse
+import pandas as pd
+import numpy as np
+import tracemalloc
+import threading
+import functools
+import time
+import json
+import sys
+import os
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+class Instrumentation:
+    """
+    This class is used to record the wall time, CPU time, memory and array sizes of every stage of the pipeline, it is opt-in and a singleton.
+
+    The pipeline functions are only marked with @instrumented, the mark returns the function unchanged, so there is no overhead when disabled.
+    enable() replaces the marked functions by timed wrappers, and disable() puts the original functions back.
+
+    Every stage is recorded as:
+
+        {
+            "stage": "BackgroundImporter.import_tech_matrix",
+            "start": <seconds since enable>,
+            "wall_seconds": ..., "cpu_seconds": ...,
+            "peak_memory_mb": <tracemalloc peak above the start, None if trace_memory is False>,
+            "max_rss_mb": <peak resident memory of the process>,
+            "output_mb": <size of the returned arrays>, "output_shapes": [...],
+            "depth": <0 for top level stages>, "parent": <name of the enclosing stage>,
+        }
+
+    Usage:
+
+        with instrument(trace_memory=True) as recorder:
+            ...
+        recorder.to_json("stages.json")
+        recorder.to_chrome_trace("trace.json")  # open in chrome://tracing or https://ui.perfetto.dev
+    """
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+        return cls._instance
+
+    def __init__(self):
+        if not hasattr(self, "records"):
+            self.enabled = False
+            self.trace_memory = False
+            self.records = []
+            self.callbacks = []
+            self._registry = []
+            self._patched = []
+            self._local = threading.local()
+            self._started_tracemalloc = False
+            self._origin = time.perf_counter()
+
+    def register(self, func, name):
+        self._registry.append((func, name))
+
+    def add_callback(self, callback):
+        """
+        Add a function called with the record of every finished stage.
+        """
+        self.callbacks.append(callback)
+
+    def remove_callback(self, callback):
+        self.callbacks.remove(callback)
+
+    def enable(self, trace_memory: bool = False, callbacks: list = None):
+        """
+        Start recording the stages.
+
+        Parameters:
+            * trace_memory: Set to True to record the peak memory of every stage with tracemalloc, it slows down python code.
+            * callbacks: The functions called with the record of every finished stage, added to the callbacks of add_callback.
+        """
+        if self.enabled:
+            self.disable()
+        self.enabled = True
+        self.trace_memory = trace_memory
+        self.records = []
+        self.callbacks.extend(callback for callback in callbacks or [] if callback not in self.callbacks)
+        self._origin = time.perf_counter()
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        self._patch()
+
+    def disable(self):
+        """
+        Stop recording, the original functions are put back, the records are kept.
+        """
+        for owner, attribute, original in reversed(self._patched):
+            setattr(owner, attribute, original)
+        self._patched = []
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+        self.enabled = False
+
+    def _patch(self):
+        """
+        Replace every marked function by its wrapper, in its class or module and in the modules of this package that imported it.
+        """
+        wrappers = {id(func): (func, self._wrap(func, name)) for func, name in self._registry}
+        for module_name, module in list(sys.modules.items()):
+            if module is None or not (module_name == __package__ or module_name.startswith(f"{__package__}.")):
+                continue
+            for owner in [module] + [value for value in vars(module).values() if isinstance(value, type) and value.__module__ == module_name]:
+                for attribute, value in list(vars(owner).items()):
+                    if id(value) in wrappers and wrappers[id(value)][0] is value:
+                        self._patched.append((owner, attribute, value))
+                        setattr(owner, attribute, wrappers[id(value)][1])
+
+    def _wrap(self, func, name):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with self.stage(name) as record:
+                result = func(*args, **kwargs)
+                record["output_mb"], record["output_shapes"] = _get_array_sizes(result)
+            return result
+
+        return wrapper
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Record a stage, also usable for user code: with instrumentation.stage("my stage"): ...
+        If the instrumentation is disabled, nothing is recorded.
+        """
+        if not self.enabled:
+            yield {}
+            return
+
+        stack = self._local.__dict__.setdefault("stack", [])
+        tracing = self.trace_memory and tracemalloc.is_tracing()
+        if tracing:
+            if stack:  # keep the peak of the parent stage before resetting it
+                stack[-1]["_peak"] = max(stack[-1]["_peak"], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        record = {
+            "stage": name,
+            "start": time.perf_counter() - self._origin,
+            "depth": len(stack),
+            "parent": stack[-1]["stage"] if stack else None,
+            "thread": threading.get_ident(),
+            "output_mb": None,
+            "output_shapes": None,
+            "_memory": tracemalloc.get_traced_memory()[0] if tracing else 0,
+            "_peak": 0,
+        }
+        stack.append(record)
+        start_wall, start_cpu = time.perf_counter(), time.process_time()
+        try:
+            yield record
+        finally:
+            record["wall_seconds"] = time.perf_counter() - start_wall
+            record["cpu_seconds"] = time.process_time() - start_cpu
+            stack.pop()
+            peak = None
+            if tracing:
+                record["_peak"] = max(record["_peak"], tracemalloc.get_traced_memory()[1])
+                peak = (record["_peak"] - record["_memory"]) / 2**20
+                if stack:
+                    stack[-1]["_peak"] = max(stack[-1]["_peak"], record["_peak"])
+            record["peak_memory_mb"] = peak
+            record["max_rss_mb"] = _get_max_rss_mb()
+            del record["_memory"], record["_peak"]
+            self.records.append(record)
+            for callback in self.callbacks:
+                callback(record)
+
+    def summary(self) -> pd.DataFrame:
+        """
+        Return the records as a dataframe, in the order the stages started.
+        """
+        if not self.records:
+            return pd.DataFrame()
+
+        return pd.DataFrame(self.records).sort_values("start").reset_index(drop=True)
+
+    def to_json(self, file_path: str, metadata: dict = None):
+        """
+        Save the records to a JSON file.
+
+        Parameters:
+            * file_path: The path of the JSON file.
+            * metadata: Information about the run saved with the records (for example the versions and the dataset), under "meta".
+        """
+        report = {"pid": os.getpid(), "stages": sorted(self.records, key=lambda record: record["start"])}
+        if metadata is not None:
+            report["meta"] = metadata
+        with open(file_path, "w") as file:
+            json.dump(report, file, indent=2)
+
+    def to_chrome_trace(self, file_path: str):
+        """
+        Save the records in the Chrome trace event format, which can be opened in chrome://tracing or Perfetto.
+        """
+        events = []
+        for record in self.records:
+            args = {key: value for key, value in record.items() if key not in ["stage", "start", "wall_seconds", "thread"]}
+            events.append({
+                "name": record["stage"],
+                "cat": "bamboo_lca",
+                "ph": "X",
+                "ts": record["start"] * 1e6,
+                "dur": record["wall_seconds"] * 1e6,
+                "pid": os.getpid(),
+                "tid": record["thread"],
+                "args": args,
+            })
+        with open(file_path, "w") as file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
+
+instrumentation = Instrumentation()
+
+
+def instrumented(name: str = None):
+    """
+    Mark a function or method as a pipeline stage, the function is returned unchanged and only wrapped while the instrumentation is enabled.
+
+    Parameters:
+        * name: The name of the stage, by default the qualified name of the function, for example "LCAWrapper.manual_lca".
+    """
+    def decorator(func):
+        instrumentation.register(func, name or func.__qualname__)
+        return func
+
+    return decorator
+
+
+@contextmanager
+def instrument(trace_memory: bool = False, callbacks: list = None):
+    """
+    Enable the instrumentation inside the with block, and yield the Instrumentation with the records.
+
+    Parameters:
+        * trace_memory: Set to True to record the peak memory of every stage with tracemalloc.
+        * callbacks: The functions called with the record of every finished stage, they are only added inside the with block.
+    """
+    added = [callback for callback in callbacks or [] if callback not in instrumentation.callbacks]
+    instrumentation.enable(trace_memory, added)
+    try:
+        yield instrumentation
+    finally:
+        instrumentation.disable()
+        for callback in added:
+            instrumentation.remove_callback(callback)
+
+
+def _get_max_rss_mb():
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    return max_rss / 2**20 if sys.platform == "darwin" else max_rss / 2**10  # bytes on macOS, kilobytes on Linux
+
+
+def _get_array_sizes(result, depth=0):
+    """
+    Get the total size in MB and the shapes of the arrays, sparse matrices and dataframes in a returned value (also inside tuples and lists).
+    """
+    if isinstance(result, np.ndarray):
+        return result.nbytes / 2**20, [list(result.shape)]
+    if sparse.issparse(result):
+        size = sum(getattr(result, part).nbytes for part in ["data", "indices", "indptr", "row", "col", "coords"] if isinstance(getattr(result, part, None), np.ndarray))
+        return size / 2**20, [list(result.shape)]
+    if isinstance(result, (pd.DataFrame, pd.Series)):
+        return result.memory_usage(deep=False).sum() / 2**20 if isinstance(result, pd.DataFrame) else result.memory_usage(deep=False) / 2**20, [list(result.shape)]
+    if isinstance(result, (tuple, list)) and depth < 2 and len(result) <= 16:
+        sizes = [_get_array_sizes(item, depth + 1) for item in result]
+        sizes = [size for size in sizes if size[0] is not None]
+        if sizes:
+            return sum(size for size, _ in sizes), [shape for _, shapes in sizes for shape in shapes]
+
+    return None, None
@@ -2,16 +2,27 @@ import bw2calc as bc
 import pandas as pd
 import numpy as np
 import os
+from concurrent.futures import ProcessPoolExecutor
+from scipy.sparse import linalg
+from scipy import sparse
+from scipy.stats import qmc
+from .technosphere_solver import TechnosphereSolver
+from .online_statistics import OnlineStatistics
+from .result_writer import CSVResultWriter
+from .utils import sample_uncertainty
+from .datapackage_store import DatapackageStore
+from .instrumentation import instrumented
 
 
 class LCAWrapper:
+    @instrumented()
     def perform_static(self, demand, datapackage, directory, k, t, myact):
         """
         Perform static simulation and save the lca score.
 
         Parameters:
             * demand: The dictionary of the functional unit, for example: {<index>: <amount>}.
-            * datapackage: The datapackage used for simulation.
+            * datapackage: The datapackage used for simulation, or the directory of a datapackage saved by DatapackageStore.
             * directory: The directory to save output file.
             * k: The case identifier.
             * t: The type of the simulation, such as "static", "uniform_0.2".
@@ -19,7 +30,7 @@ class LCAWrapper:
         """
         lca = bc.LCA(
             demand=demand,
-            data_objs=[datapackage],
+            data_objs=[_load_datapackage(datapackage)],
         )
         lca.lci()
         lca.lcia()
@@ -33,38 +44,445 @@ class LCAWrapper:
             file.write(f"{lca.score}")
             print(f"Static LCA result saved to {filename}.")
 
-    def perform_stochastic(self, index, datapackage, directory, k, t, myact, batch_size=50, num_batches=10):
+    @instrumented()
+    def perform_stochastic(self, index, datapackage, directory, k, t, myact, batch_size=50, num_batches=10, num_workers=None, seed=None, rtol=None, confidence=0.95, min_iterations=None, writer=None):
         """
         Perform Monte Carlo simulation and save the lca score.
-        """
-        lca = bc.LCA(
-            demand={index: 1},
-            data_objs=[datapackage],
-            use_distributions=True,
-        )
-        lca.lci()
-        lca.lcia()
 
-        print(f"Brightway calculated lca score(with uncertainty): {lca.score, myact}")
+        Parameters:
+            * index: The index of the functional unit.
+            * datapackage: The datapackage with uncertainty used for simulation, or the directory of a datapackage saved by DatapackageStore.
+            * directory: The directory to save output file.
+            * k: The case identifier.
+            * t: The type of the simulation, such as "static", "uniform_0.2".
+            * myact: 
+            * batch_size: The number of iterations in one batch.
+            * num_batches: The maximum number of batches.
+            * num_workers: The number of processes, set it to spread the batches over a process pool.
+            * seed: The master seed, every batch gets its own seed stream from it, so the results are the same for any num_workers.
+            * rtol: The stopping rule, stop as soon as the half-width of the confidence interval of the mean is below rtol times the mean, for example 0.01. By default, all batches are run.
+            * confidence: The confidence level of the stopping rule.
+            * min_iterations: The minimum number of iterations before the stopping rule is checked, by default two batches.
+            * writer: The result writer, such as ResultWriter(directory) for the binary columnar format. By default, the scores are saved in csv format to CASE_{k}_{t}_MC_simulations_{myact}.csv.
+
+        Returns:
+            * OnlineStatistics: Return the statistics of the lca scores.
+        """
         os.makedirs(directory, exist_ok=True)
-        filename = os.path.join(directory, f"CASE_{k}_{t}_MC_simulations_{myact}.csv")
+        if writer is None:
+            writer = CSVResultWriter(os.path.join(directory, f"CASE_{k}_{t}_MC_simulations_{myact}.csv"))
+        min_iterations = 2 * batch_size if min_iterations is None else min_iterations
 
-        with open(filename, "w") as file:
-            file.write("kg CO2eq\n")
-            for p in range(num_batches):
-                batch_results = [lca.score for _ in zip(range(batch_size), lca)]
-                df_batch = pd.DataFrame(batch_results, columns=["kg CO2eq"])
-                df_batch.to_csv(file, header=False, index=False)
-                print(f"Batch {p} saved to {filename}.")
+        if num_workers is None and seed is None:
+            lca = bc.LCA(
+                demand={index: 1},
+                data_objs=[_load_datapackage(datapackage)],
+                use_distributions=True,
+            )
+            lca.lci()
+            lca.lcia()
+
+            print(f"Brightway calculated lca score(with uncertainty): {lca.score, myact}")
+            batches = ((None, scores, _get_batch_statistics(scores)) for scores in ([lca.score for _ in zip(range(batch_size), lca)] for _ in range(num_batches)))
+        else:
+            batches = self._run_stochastic_batches({index: 1}, datapackage, batch_size, num_batches, num_workers, seed)
+
+        statistics = OnlineStatistics()
+        destination = getattr(writer, "filename", getattr(writer, "directory", None))
+        for p, (batch_seed, batch_results, batch_statistics) in enumerate(batches):
+            writer.write(batch_results, seed=batch_seed, functional_unit=index, sample_start=p * batch_size)
+            statistics.merge(batch_statistics)
+            print(f"Batch {p} saved to {destination}.")
+            if rtol is not None and statistics.is_converged(rtol, confidence, min_iterations):
+                print(f"Converged after {statistics.count} iterations: mean {statistics.mean}, {confidence:.0%} half-width {statistics.half_width(confidence)}.")
+                batches.close()
+                break
 
-        print(f"Results saved to {filename}.")
+        print(f"Results saved to {destination}.")
 
-    def manual_lca(self, A, B, C, index): 
+        return statistics
+
+    def _run_stochastic_batches(self, demand, datapackage, batch_size, num_batches, num_workers=None, seed=None):
+        """
+        Run the Monte Carlo batches, in this process or over a process pool, and yield the seed, scores and statistics of every batch in order.
+
+        Every batch gets its own seed spawned from the master seed, so the results only depend on the seed, batch_size and num_batches.
+        """
+        if seed is None:
+            seed = np.random.SeedSequence().entropy
+            print(f"Monte Carlo master seed: {seed}")
+        tasks = [(int(batch_seed.generate_state(1)[0]), batch_size) for batch_seed in np.random.SeedSequence(seed).spawn(num_batches)]
+
+        if num_workers is None or num_workers <= 1:
+            datapackage = _load_datapackage(datapackage)
+            for batch_seed, size in tasks:
+                scores = _simulate_batch(demand, datapackage, batch_seed, size)
+                yield batch_seed, scores, _get_batch_statistics(scores)
+        else:
+            # the datapackage is sent to every worker once, instead of with every task.
+            # a memory-mapped datapackage of DatapackageStore is sent as its path, so the workers map the same files instead of receiving copies.
+            path = DatapackageStore.get_datapackage_path(datapackage) if not isinstance(datapackage, (str, os.PathLike)) else datapackage
+            executor = ProcessPoolExecutor(max_workers=num_workers, initializer=_init_stochastic_worker, initargs=(demand, datapackage if path is None else path))
+            try:
+                futures = [executor.submit(_run_stochastic_batch, task) for task in tasks]
+                for future in futures:
+                    yield future.result()
+            finally:  # the batches which are not needed anymore (e.g. converged) are cancelled.
+                executor.shutdown(wait=True, cancel_futures=True)
+
+    @instrumented()
+    def manual_lca(self, A, B, C, index, solver=None):
         """
-        Perform Monte Carlo simulation without brightway.
+        Perform LCA calculation without brightway.
+
+        Parameters:
+            * A: The technosphere matrix (I-A) in numpy or scipy sparse format.
+            * B: The biosphere matrix.
+            * C: The characterization factor matrix.
+            * index: The index of the functional unit.
+            * solver: A TechnosphereSolver of A, pass the same solver to reuse the factorization across calls. By default, A is factorized in every call.
         """
-        f = np.zeros((len(A), 1))
+        if solver is None:
+            solver = TechnosphereSolver(A)
+
+        f = np.zeros(A.shape[0])
         f[index] = 1
-        lca_score = np.sum(C.dot(B.dot((np.linalg.inv(A)).dot(f))))
+        lca_score = np.sum(C @ (B @ solver.solve(f)))
         
-        return float(lca_score)
\ No newline at end of file
+        return float(lca_score)
+
+    @instrumented()
+    def manual_lca_all(self, A, B, C, activities: list, solver=None):
+        """
+        Calculate the lca score of every activity as functional unit with a single transposed solve: 
+            scores = 1^T C B (I-A)^-1, so (I-A)^T scores = (C B)^T 1.
+
+        Parameters:
+            * A: The technosphere matrix (I-A) in numpy or scipy sparse format.
+            * B: The biosphere matrix.
+            * C: The characterization factor matrix.
+            * activities: The list of all activities, the same order as the columns of A.
+            * solver: A TechnosphereSolver of A, by default A is factorized in this call.
+
+        Returns:
+            * pd.Series: Return the lca score of one unit of every activity, indexed by activity name.
+        """
+        if solver is None:
+            solver = TechnosphereSolver(A)
+
+        characterized = np.asarray((C @ B).sum(axis=0)).ravel()
+        scores = solver.solve_transposed(characterized)
+
+        return pd.Series(scores, index=activities, name="score")
+
+    @instrumented()
+    def manual_lca_methods(self, A, B, cf_operator, index, methods: list = None, solver=None):
+        """
+        Calculate the lca scores of many methods from a single inventory: scores = Q B (I-A)^-1 f.
+
+        Parameters:
+            * A: The technosphere matrix (I-A) in numpy or scipy sparse format.
+            * B: The biosphere matrix.
+            * cf_operator: The characterization operator Q from BackgroundImporter.build_cf_operator, one row per method.
+            * index: The index of the functional unit.
+            * methods: The names of the methods, the same order as the rows of cf_operator.
+            * solver: A TechnosphereSolver of A, by default A is factorized in this call.
+
+        Returns:
+            * pd.Series: Return the lca score of every method.
+        """
+        if solver is None:
+            solver = TechnosphereSolver(A)
+
+        f = np.zeros(A.shape[0])
+        f[index] = 1
+        scores = cf_operator @ (B @ solver.solve(f))
+
+        return pd.Series(np.asarray(scores).ravel(), index=methods, name="score")
+
+    @instrumented()
+    def manual_lca_all_methods(self, A, B, cf_operator, activities: list, methods: list = None, solver=None):
+        """
+        Calculate the lca scores of many methods for every activity as functional unit, with one transposed solve per method:
+            (I-A)^T scores = (Q B)^T.
+
+        Parameters:
+            * A: The technosphere matrix (I-A) in numpy or scipy sparse format.
+            * B: The biosphere matrix.
+            * cf_operator: The characterization operator Q from BackgroundImporter.build_cf_operator, one row per method.
+            * activities: The list of all activities, the same order as the columns of A.
+            * methods: The names of the methods, the same order as the rows of cf_operator.
+            * solver: A TechnosphereSolver of A, by default A is factorized in this call.
+
+        Returns:
+            * pd.DataFrame: Return the lca score of one unit of every activity (rows) for every method (columns).
+        """
+        if solver is None:
+            solver = TechnosphereSolver(A)
+
+        characterized = sparse.csr_array(cf_operator @ B).toarray()
+        scores = solver.solve_transposed(characterized.T).reshape(A.shape[0], -1)
+
+        return pd.DataFrame(scores, index=activities, columns=methods)
+
+
+SOBOL_MAX_DIMENSIONS = 21201  # the maximum dimension of scipy.stats.qmc.Sobol
+
+
+class MonteCarloEngine:
+    """
+    This class is used to perform Monte Carlo simulation without brightway, for the same arrays that are used to build the datapackage.
+
+    All uncertain parameters of a batch are sampled at once as arrays (types 0-4, with the negative flag and the flip array), 
+    and every iteration is solved with an iterative solver preconditioned by the LU factorization of the static technosphere,
+    instead of resampling, rebuilding and refactorizing the whole system.
+
+    Supported sampling designs:
+        * "random": plain pseudo-random numbers (default).
+        * "lhs": Latin hypercube, every batch is stratified in every dimension.
+        * "sobol": scrambled Sobol sequence, continued over the batches of one run, use a power of 2 for batch_size and iterations.
+            scipy supports at most 21201 Sobol dimensions (one dimension per uncertain value), the uncertain values above this limit
+            (the last ones, in technosphere, biosphere, characterization order) are sampled with a Latin hypercube instead.
+    """
+    def __init__(self, datapackage_data, uncertainty, rtol=1e-10, backend="superlu", sampling="random"):
+        """
+        Parameters:
+            * datapackage_data: The matrices data from DatapackageBuilder.prepare_dp_matrix.
+            * uncertainty: The uncertainty arrays for technosphere, biosphere and characterization factor matrices, None for no uncertainty.
+            * rtol: The relative tolerance of the iterative solver.
+            * backend: The sparse LU backend of the static technosphere, see TechnosphereSolver.
+            * sampling: The sampling design, "random", "lhs" or "sobol", "sobol" uses at most SOBOL_MAX_DIMENSIONS (21201) dimensions, see above.
+        """
+        if sampling not in ["random", "lhs", "sobol"]:
+            raise ValueError(f'Sampling {sampling} is not supported, please set the sampling to "random", "lhs" or "sobol".')
+        self.sampling = sampling
+        self._sobol = None
+        tech_data, tech_indices, tech_flip = datapackage_data[0]
+        bio_data, bio_indices = datapackage_data[1]
+        cf_data, cf_indices = datapackage_data[2]
+        uncertainty = [None, None, None] if uncertainty is None else uncertainty
+        self.rtol = rtol
+
+        # map the matrix ids to matrix positions, the same way brightway does.
+        self.activity_ids = np.unique(np.concatenate([tech_indices["row"], tech_indices["col"]]))
+        self.emission_ids = np.unique(np.concatenate([bio_indices["row"], cf_indices["row"], cf_indices["col"]]))
+        tech_flip = np.asarray(tech_flip, dtype=bool)
+        self.matrices = {
+            "technosphere": self._prepare_matrix(tech_data, tech_indices, tech_flip, uncertainty[0], self.activity_ids, self.activity_ids),
+            "biosphere": self._prepare_matrix(bio_data, bio_indices, None, uncertainty[1], self.emission_ids, self.activity_ids),
+            "characterization": self._prepare_matrix(cf_data, cf_indices, None, uncertainty[2], self.emission_ids, self.emission_ids),
+        }
+        # the fixed (type 0 and 1) values are at loc, so the static technosphere is built with them, like the biosphere and characterization matrices.
+        technosphere = self.matrices["technosphere"]
+        self.solver = TechnosphereSolver(self._build_matrix("technosphere", technosphere.get("static_sample", technosphere["static"])), backend)
+        self.preconditioner = linalg.LinearOperator(self.solver.matrix.shape, matvec=self.solver.solve)
+
+    def _prepare_matrix(self, data, indices, flip, uncertainty, row_ids, col_ids):
+        """
+        Precompute the CSR structure of one matrix, the static values and the parameters of the uncertain values.
+        """
+        rows = np.searchsorted(row_ids, indices["row"])
+        cols = np.searchsorted(col_ids, indices["col"])
+        sign = np.where(flip, -1.0, 1.0) if flip is not None else np.ones(len(data))
+
+        # position of every entry in the CSR data array, duplicated entries are summed.
+        keys = rows.astype(np.int64) * len(col_ids) + cols
+        unique_keys, position = np.unique(keys, return_inverse=True)
+        structure = sparse.csr_array(
+            (np.ones(len(unique_keys)), (unique_keys // len(col_ids), unique_keys % len(col_ids))),
+            shape=(len(row_ids), len(col_ids)),
+        )
+        structure.sort_indices()
+
+        matrix = {"structure": structure, "position": position, "sign": sign, "static": np.asarray(data, dtype=float)}
+        if uncertainty is None:
+            matrix["uncertain"] = np.zeros(0, dtype=int)
+            return matrix
+
+        uncertainty_type = uncertainty["uncertainty_type"]
+        unsupported = ~np.isin(uncertainty_type, [0, 1, 2, 3, 4])
+        if unsupported.any():
+            raise ValueError(f"Uncertainty type {np.unique(uncertainty_type[unsupported]).tolist()} is not supported, supported types: 0, 1, 2, 3, 4.")
+
+        # types 0 and 1 are fixed at loc, like stats_arrays does.
+        fixed = uncertainty_type < 2
+        undefined = ~fixed & np.where(uncertainty_type == 4, np.isnan(uncertainty["minimum"]) | np.isnan(uncertainty["maximum"]), np.isnan(uncertainty["loc"]) | np.isnan(uncertainty["scale"]))
+        if undefined.any():
+            raise ValueError(f"{undefined.sum()} uncertain value(s) have undefined distribution parameters, for example: {uncertainty[undefined][:3].tolist()}")
+        matrix["static_sample"] = matrix["static"].copy()
+        matrix["static_sample"][fixed] = uncertainty["loc"][fixed]
+        matrix["uncertain"] = np.flatnonzero(~fixed)
+        matrix["params"] = uncertainty[~fixed]
+
+        return matrix
+
+    def _build_matrix(self, name, values):
+        """
+        Build one matrix from the entry values, applying the flip array.
+        """
+        matrix = self.matrices[name]
+        built = matrix["structure"].copy()
+        built.data = np.bincount(matrix["position"], weights=values * matrix["sign"], minlength=len(built.data))
+
+        return built
+
+    def _get_uniforms(self, iterations, dimensions, rng):
+        """
+        Get the uniform random numbers in [0, 1) for one batch, one column per uncertain parameter.
+        """
+        if self.sampling == "lhs":
+            return qmc.LatinHypercube(dimensions, seed=rng).random(iterations)
+        if self.sampling == "sobol":
+            sobol_dimensions = min(dimensions, SOBOL_MAX_DIMENSIONS)
+            if self._sobol is None or self._sobol.d != sobol_dimensions:
+                if dimensions > SOBOL_MAX_DIMENSIONS:
+                    print(f"{dimensions} uncertain values is above the {SOBOL_MAX_DIMENSIONS} Sobol dimensions supported by scipy, the last {dimensions - SOBOL_MAX_DIMENSIONS} are sampled with a Latin hypercube.")
+                self._sobol = qmc.Sobol(sobol_dimensions, scramble=True, seed=rng)
+            uniforms = self._sobol.random(iterations)
+            if dimensions > sobol_dimensions:
+                uniforms = np.hstack([uniforms, qmc.LatinHypercube(dimensions - sobol_dimensions, seed=rng).random(iterations)])
+            return uniforms
+
+        return rng.random((iterations, dimensions))
+
+    def _transform(self, params, uniforms):
+        """
+        Map uniform random numbers through the inverse CDF of every parameter distribution.
+        """
+        return sample_uncertainty(params, uniforms)
+
+    def sample(self, iterations, rng):
+        """
+        Sample the uncertain values of all matrices for one batch.
+
+        Parameters:
+            * iterations: The number of iterations in the batch.
+            * rng: A numpy random Generator.
+
+        Returns:
+            * dict: Return the sampled values of every matrix with uncertainty, one row per iteration.
+        """
+        dimensions = [len(matrix["uncertain"]) for matrix in self.matrices.values()]
+        uniforms = self._get_uniforms(iterations, sum(dimensions), rng)
+
+        samples, start = {}, 0
+        for (name, matrix), dimension in zip(self.matrices.items(), dimensions):
+            if dimension:
+                samples[name] = self._transform(matrix["params"], uniforms[:, start:start + dimension])
+            start += dimension
+
+        return samples
+
+    def _get_matrix(self, name, samples, i):
+        """
+        Get one matrix of iteration i, matrices without uncertain values are only built once.
+        """
+        matrix = self.matrices[name]
+        if name not in samples:
+            if "built" not in matrix:
+                matrix["built"] = self._build_matrix(name, matrix.get("static_sample", matrix["static"]))
+            return matrix["built"]
+
+        values = matrix["static_sample"].copy()
+        values[matrix["uncertain"]] = samples[name][i]
+
+        return self._build_matrix(name, values)
+
+    def _solve(self, tech_matrix, demand, x0):
+        """
+        Solve one iteration with GMRES preconditioned by the static factorization, fall back to a direct solve if it doesn't converge.
+        """
+        x, info = linalg.gmres(tech_matrix, demand, x0=x0, M=self.preconditioner, rtol=self.rtol, atol=0)
+        if info != 0:
+            x = linalg.spsolve(sparse.csc_array(tech_matrix), demand)
+
+        return x
+
+    def run(self, index, iterations, batch_size=100, seed=None, writer=None):
+        """
+        Perform Monte Carlo simulation and return the lca scores.
+
+        Parameters:
+            * index: The index of the functional unit.
+            * iterations: The number of iterations.
+            * batch_size: The number of iterations sampled at once.
+            * seed: The master seed, an int, a np.random.SeedSequence or a np.random.Generator, every batch gets its own int seed from it.
+            * writer: The result writer (ResultWriter or CSVResultWriter), every batch is appended to it with its int seed.
+
+        Returns:
+            * np.ndarray: Return the lca score of every iteration.
+        """
+        if isinstance(seed, np.random.Generator):
+            seed = np.random.SeedSequence(int(seed.integers(2**63)))
+        elif not isinstance(seed, np.random.SeedSequence):
+            seed = np.random.SeedSequence(seed)
+        starts = range(0, iterations, batch_size)
+        batch_seeds = [int(batch_seed.generate_state(1)[0]) for batch_seed in seed.spawn(len(starts))]
+        self._sobol = None  # every run starts a new scrambled sequence
+        position = np.searchsorted(self.activity_ids, index)
+        if position >= len(self.activity_ids) or self.activity_ids[position] != index:
+            raise ValueError(f"Activity {index} is not in the technosphere matrix.")
+        demand = np.zeros(len(self.activity_ids))
+        demand[position] = 1
+        x0 = self.solver.solve(demand)
+
+        scores = np.empty(iterations)
+        for start, batch_seed in zip(starts, batch_seeds):
+            size = min(batch_size, iterations - start)
+            samples = self.sample(size, np.random.default_rng(batch_seed))
+            for i in range(size):
+                tech_matrix, bio_matrix, cf_matrix = [self._get_matrix(name, samples, i) for name in self.matrices]
+                x = x0 if "technosphere" not in samples else self._solve(tech_matrix, demand, x0)
+                scores[start + i] = np.sum(cf_matrix @ (bio_matrix @ x))
+            if writer is not None:
+                writer.write(scores[start:start + size], seed=batch_seed, functional_unit=index, sample_start=start)
+
+        return scores
+
+
+_worker_state = {}
+
+
+def _simulate_batch(demand, datapackage, seed, batch_size):
+    """
+    Draw one batch of Monte Carlo lca scores with a seeded brightway LCA.
+    """
+    lca = bc.LCA(
+        demand=demand,
+        data_objs=[datapackage],
+        use_distributions=True,
+        seed_override=seed,
+    )
+    lca.lci()
+    lca.lcia()
+
+    return [lca.score for _ in zip(range(batch_size), lca)]
+
+
+def _load_datapackage(datapackage):
+    """
+    Load a datapackage given by its directory with memory-mapped arrays, other datapackages are returned as they are.
+    """
+    if isinstance(datapackage, (str, os.PathLike)):
+        return DatapackageStore.load(datapackage)
+
+    return datapackage
+
+
+def _get_batch_statistics(scores):
+    statistics = OnlineStatistics()
+    statistics.update(scores)
+
+    return statistics
+
+
+def _init_stochastic_worker(demand, datapackage):
+    _worker_state["demand"] = demand
+    _worker_state["datapackage"] = _load_datapackage(datapackage)
+
+
+def _run_stochastic_batch(task):
+    seed, batch_size = task
+    scores = _simulate_batch(_worker_state["demand"], _worker_state["datapackage"], seed, batch_size)
+
+    return seed, scores, _get_batch_statistics(scores)
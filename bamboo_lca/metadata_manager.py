@@ -1,3 +1,6 @@
+import numpy as np
+
+
 class MetadataManager:
     """
     This class is used to manage metadata of this library, the metadata is designed for handling ununiformly uncertainty analysis.
@@ -44,4 +47,185 @@ class MetadataManager:
     def _get_metadata(self):
         return self.metadata
     
-metadata_manager = MetadataManager()
\ No newline at end of file
+metadata_manager = MetadataManager()
+
+
+class UncertaintyMetadata:
+    """
+    This class is a columnar alternative to MetadataManager, it is not a singleton, so several models can be prepared in one process.
+
+    The uncertainty information is stored as NumPy arrays indexed by activity (column) index:
+
+        activities: the activity names, the position is the column index.
+        uncertainty_type: the activity uncertainty type of every column, by default 0.
+        gsd: the columnwise uncertainty value of every column, by default 0.
+        negative: the columnwise uncertainty negative of every column, by default False.
+        itemwise: whether the column has itemwise uncertainty values.
+
+    The itemwise uncertainty values are stored as sparse (row, col) arrays, only non-default values are kept:
+
+        item_rows, item_cols, item_gsd, item_negative
+    """
+    def __init__(self, activities: list):
+        """
+        Parameters:
+            * activities: The list of all activities, the same order as the columns of the technosphere matrix.
+        """
+        self.activities = list(activities)
+        size = len(self.activities)
+        self.uncertainty_type = np.zeros(size)
+        self.gsd = np.zeros(size)
+        self.negative = np.zeros(size, dtype=bool)
+        self.itemwise = np.zeros(size, dtype=bool)
+        self._item_chunks = []
+        self._items = None
+        self._item_keys = None
+
+    def __len__(self):
+        return len(self.activities)
+
+    def update_column(self, index, uncertainty_type, gsd, negative):
+        """
+        Set the columnwise uncertainty of one column.
+
+        Parameters:
+            * index: The column index of the activity.
+            * uncertainty_type: The activity uncertainty type.
+            * gsd: The uncertainty value of all exchanges of the column.
+            * negative: The uncertainty negative of all exchanges of the column.
+        """
+        self.uncertainty_type[index] = uncertainty_type
+        self.gsd[index] = gsd
+        self.negative[index] = negative
+
+    def update_items(self, index, uncertainty_type, gsd_list, negative_list):
+        """
+        Set the itemwise uncertainty of one column.
+
+        Parameters:
+            * index: The column index of the activity.
+            * uncertainty_type: The activity uncertainty type.
+            * gsd_list: The uncertainty value of every row of the column.
+            * negative_list: The uncertainty negative of every row of the column.
+        """
+        gsd_list = np.asarray(gsd_list, dtype=float)
+        negative_list = np.asarray(negative_list, dtype=bool)
+        if self.itemwise[index]:  # drop the previous values of this column
+            rows, cols, gsd, negative = self.get_items()
+            keep = cols != index
+            self._item_chunks = [(rows[keep], cols[keep], gsd[keep], negative[keep])]
+
+        rows = np.flatnonzero((gsd_list != 0) | negative_list)
+        self._item_chunks.append((rows, np.full(len(rows), index), gsd_list[rows], negative_list[rows]))
+        self._items = None
+        self.uncertainty_type[index] = uncertainty_type
+        self.itemwise[index] = True
+
+    def get_items(self):
+        """
+        Get the itemwise uncertainty values sorted by (col, row).
+
+        Returns:
+            * tuple: Return the item_rows, item_cols, item_gsd and item_negative arrays.
+        """
+        if self._items is None:
+            if self._item_chunks:
+                rows, cols, gsd, negative = [np.concatenate(parts) for parts in zip(*self._item_chunks)]
+            else:
+                rows, cols, gsd, negative = np.zeros(0, dtype=int), np.zeros(0, dtype=int), np.zeros(0), np.zeros(0, dtype=bool)
+            order = np.lexsort((rows, cols))
+            self._items = (rows[order], cols[order], gsd[order], negative[order])
+            self._item_keys = self._items[1].astype(np.int64) * len(self) + self._items[0]
+            self._item_chunks = [self._items]
+
+        return self._items
+
+    def get_column_values(self, cols):
+        """
+        Get the columnwise uncertainty for many columns at once.
+
+        Parameters:
+            * cols: The column indices.
+
+        Returns:
+            * tuple: Return the uncertainty type, gsd and negative arrays.
+        """
+        return self.uncertainty_type[cols], self.gsd[cols], self.negative[cols]
+
+    def get_item_values(self, rows, cols):
+        """
+        Get the itemwise uncertainty for many (row, col) positions at once, positions without a stored value get 0 and False.
+
+        Parameters:
+            * rows: The row indices, in the range of the activities.
+            * cols: The column indices.
+
+        Returns:
+            * tuple: Return the gsd and negative arrays.
+        """
+        item_rows, item_cols, item_gsd, item_negative = self.get_items()
+        gsd, negative = np.zeros(len(rows)), np.zeros(len(rows), dtype=bool)
+        if len(self._item_keys) == 0:
+            return gsd, negative
+
+        query = np.asarray(cols, dtype=np.int64) * len(self) + np.asarray(rows, dtype=np.int64)
+        position = np.minimum(np.searchsorted(self._item_keys, query), len(self._item_keys) - 1)
+        found = self._item_keys[position] == query
+        gsd[found] = item_gsd[position[found]]
+        negative[found] = item_negative[position[found]]
+
+        return gsd, negative
+
+    @classmethod
+    def from_metadata(cls, metadata: dict):
+        """
+        Convert the dictionary metadata of MetadataManager into the columnar format.
+
+        Parameters:
+            * metadata: The metadata dictionary, see MetadataManager.
+        """
+        store = cls([metadata[i]["Activity name"] for i in range(len(metadata))])
+        for i in range(len(metadata)):
+            value = metadata[i]
+            uncertainty_type = value.get("Activity uncertainty type", 0)
+            amount = value.get("Exchange uncertainty amount", 0)
+            negative = value.get("Exchange negative", False)
+            if isinstance(amount, list):
+                store.update_items(i, uncertainty_type, amount, negative)
+            else:
+                store.update_column(i, uncertainty_type, amount, bool(negative))
+
+        return store
+
+    def save(self, file_path: str):
+        """
+        Save the metadata to a .npz file.
+        """
+        item_rows, item_cols, item_gsd, item_negative = self.get_items()
+        np.savez(
+            file_path,
+            activities=np.array(self.activities, dtype=str),
+            uncertainty_type=self.uncertainty_type,
+            gsd=self.gsd,
+            negative=self.negative,
+            itemwise=self.itemwise,
+            item_rows=item_rows,
+            item_cols=item_cols,
+            item_gsd=item_gsd,
+            item_negative=item_negative,
+        )
+
+    @classmethod
+    def load(cls, file_path: str):
+        """
+        Load the metadata from a .npz file written by save.
+        """
+        with np.load(file_path) as arrays:
+            store = cls(arrays["activities"].tolist())
+            store.uncertainty_type = arrays["uncertainty_type"]
+            store.gsd = arrays["gsd"]
+            store.negative = arrays["negative"]
+            store.itemwise = arrays["itemwise"]
+            store._item_chunks = [(arrays["item_rows"], arrays["item_cols"], arrays["item_gsd"], arrays["item_negative"])]
+
+        return store
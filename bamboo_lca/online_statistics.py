@@ -0,0 +1,182 @@
+from scipy import special
+import numpy as np
+
+
+class QuantileSketch:
+    """
+    This class is used to estimate quantiles of a stream of values in bounded memory, it is a merging t-digest.
+
+    The values are kept as weighted centroids, the centroids are small near the tails, so the extreme percentiles stay accurate.
+    Two sketches can be merged, so every worker can keep its own sketch.
+    """
+    def __init__(self, compression: float = 100):
+        """
+        Parameters:
+            * compression: The larger the compression, the more centroids are kept and the more accurate the quantiles are.
+        """
+        self.compression = compression
+        self.means = np.zeros(0)
+        self.weights = np.zeros(0)
+        self.minimum = np.inf
+        self.maximum = -np.inf
+        self._buffer = []
+        self._buffer_size = 0
+
+    def update(self, values):
+        values = np.asarray(values, dtype=float).ravel()
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return
+        self.minimum = min(self.minimum, values.min())
+        self.maximum = max(self.maximum, values.max())
+        self._buffer.append(values)
+        self._buffer_size += len(values)
+        if self._buffer_size > 10 * self.compression:
+            self._compress()
+
+    def merge(self, other: "QuantileSketch"):
+        other._compress()
+        self.minimum = min(self.minimum, other.minimum)
+        self.maximum = max(self.maximum, other.maximum)
+        self._compress(other.means, other.weights)
+
+    def _scale(self, q):
+        return self.compression / (2 * np.pi) * np.arcsin(2 * q - 1)
+
+    def _compress(self, means=None, weights=None):
+        """
+        Merge the buffered values (and optionally the centroids of another sketch) into the centroids.
+        """
+        buffered = np.concatenate(self._buffer) if self._buffer else np.zeros(0)
+        all_means = np.concatenate([self.means, buffered] + ([means] if means is not None else []))
+        all_weights = np.concatenate([self.weights, np.ones(len(buffered))] + ([weights] if weights is not None else []))
+        self._buffer, self._buffer_size = [], 0
+        if len(all_means) == 0:
+            return
+
+        order = np.argsort(all_means, kind="stable")
+        all_means, all_weights = all_means[order], all_weights[order]
+        total = all_weights.sum()
+
+        new_means, new_weights = [all_means[0]], [all_weights[0]]
+        weight_so_far = 0.0
+        k_left = self._scale(0.0)
+        for mean, weight in zip(all_means[1:], all_weights[1:]):
+            if self._scale(min((weight_so_far + new_weights[-1] + weight) / total, 1.0)) - k_left <= 1:
+                merged_weight = new_weights[-1] + weight
+                new_means[-1] += (mean - new_means[-1]) * weight / merged_weight
+                new_weights[-1] = merged_weight
+            else:
+                weight_so_far += new_weights[-1]
+                k_left = self._scale(weight_so_far / total)
+                new_means.append(mean)
+                new_weights.append(weight)
+
+        self.means, self.weights = np.array(new_means), np.array(new_weights)
+
+    def quantile(self, q):
+        """
+        Estimate the q-th quantile, q in [0, 1].
+        """
+        self._compress()
+        if len(self.means) == 0:
+            return np.nan
+        total = self.weights.sum()
+        centers = np.concatenate([[0], np.cumsum(self.weights) - self.weights / 2, [total]])
+        means = np.concatenate([[self.minimum], self.means, [self.maximum]])
+
+        return float(np.interp(q * total, centers, means))
+
+
+class OnlineStatistics:
+    """
+    This class is used to accumulate the statistics of Monte Carlo scores batch by batch:
+    count, mean and variance (Welford / Chan et al.), minimum, maximum and quantiles (QuantileSketch).
+
+    The accumulators of different batches or workers can be merged.
+    """
+    def __init__(self, compression: float = 100):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.minimum = np.inf
+        self.maximum = -np.inf
+        self.sketch = QuantileSketch(compression)
+
+    def update(self, values):
+        """
+        Add a batch of values.
+        """
+        values = np.asarray(values, dtype=float).ravel()
+        if len(values) == 0:
+            return
+
+        batch = OnlineStatistics(self.sketch.compression)
+        batch.count = len(values)
+        batch.mean = float(values.mean())
+        batch.m2 = float(((values - batch.mean) ** 2).sum())
+        batch.minimum = float(values.min())
+        batch.maximum = float(values.max())
+        batch.sketch.update(values)
+        self.merge(batch)
+
+    def merge(self, other: "OnlineStatistics"):
+        """
+        Merge the statistics of another accumulator into this one.
+        """
+        if other.count == 0:
+            return
+
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta ** 2 * self.count * other.count / count
+        self.count = count
+        self.minimum = min(self.minimum, other.minimum)
+        self.maximum = max(self.maximum, other.maximum)
+        self.sketch.merge(other.sketch)
+
+    @property
+    def variance(self):
+        return self.m2 / (self.count - 1) if self.count > 1 else np.nan
+
+    @property
+    def std(self):
+        return float(np.sqrt(self.variance))
+
+    @property
+    def standard_error(self):
+        return self.std / np.sqrt(self.count) if self.count > 1 else np.nan
+
+    def half_width(self, confidence: float = 0.95):
+        """
+        The half-width of the confidence interval of the mean.
+        """
+        return float(special.ndtri((1 + confidence) / 2) * self.standard_error)
+
+    def quantile(self, q):
+        return self.sketch.quantile(q)
+
+    def is_converged(self, rtol: float, confidence: float = 0.95, min_iterations: int = 2):
+        """
+        Check the stopping rule: the half-width of the confidence interval is below rtol times the absolute mean.
+
+        Parameters:
+            * rtol: The target relative half-width, for example 0.01.
+            * confidence: The confidence level of the interval.
+            * min_iterations: The minimum number of values before the rule is checked.
+        """
+        if self.count < max(min_iterations, 2):
+            return False
+
+        return self.half_width(confidence) <= rtol * abs(self.mean)
+
+    def summary(self, percentiles=(0.025, 0.5, 0.975)) -> dict:
+        """
+        Return the statistics as a dictionary.
+        """
+        summary = {"count": self.count, "mean": self.mean, "std": self.std, "min": self.minimum, "max": self.maximum}
+        for q in percentiles:
+            summary[f"{q:.1%}"] = self.quantile(q)
+
+        return summary
@@ -0,0 +1,150 @@
+import pandas as pd
+import numpy as np
+import json
+import os
+
+
+class ResultWriter:
+    """
+    This class is used to append Monte Carlo results to an append-only binary columnar store, which can be read back with memory maps.
+
+    Every process writes its own shard, so the writer can be used from several worker processes at the same time:
+
+        directory/
+            shard-<pid>/
+                schema.json  (column names, dtypes and impact categories)
+                sample.bin, seed.bin, functional_unit.bin, impact_0.bin, impact_1.bin, ...
+
+    Every column is a raw little-endian array, a batch is appended to the end of every column file.
+    The number of rows of a shard is the length of its shortest column, so a batch interrupted during writing is ignored.
+    """
+    INDEX_COLUMNS = [("sample", "<i8"), ("seed", "<i8"), ("functional_unit", "<i8")]
+
+    def __init__(self, directory: str, impact_categories: list = None):
+        """
+        Parameters:
+            * directory: The directory to save the shards.
+            * impact_categories: The list of impact categories, one column per impact category, by default ["kg CO2eq"].
+        """
+        self.directory = directory
+        self.impact_categories = ["kg CO2eq"] if impact_categories is None else list(impact_categories)
+        self.columns = self.INDEX_COLUMNS + [(f"impact_{i}", "<f8") for i in range(len(self.impact_categories))]
+        self._sample = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _get_shard_dir(self):
+        """
+        Get the shard of the current process, the shard is created at the first write in every process.
+        """
+        shard_dir = os.path.join(self.directory, f"shard-{os.getpid()}")
+        schema_file = os.path.join(shard_dir, "schema.json")
+        if not os.path.exists(schema_file):
+            os.makedirs(shard_dir, exist_ok=True)
+            schema = {"columns": [{"name": name, "dtype": dtype} for name, dtype in self.columns], "impact_categories": self.impact_categories}
+            with open(f"{schema_file}.tmp", "w") as file:
+                json.dump(schema, file)
+            os.replace(f"{schema_file}.tmp", schema_file)
+
+        return shard_dir
+
+    def write(self, scores, seed: int = None, functional_unit: int = -1, sample_start: int = None):
+        """
+        Append a batch of results.
+
+        Parameters:
+            * scores: The scores of the batch, a vector for one impact category, or a matrix with one column per impact category.
+            * seed: The seed of the batch, -1 if unknown.
+            * functional_unit: The index of the functional unit.
+            * sample_start: The sample index of the first row, by default the samples are numbered in the order they are written.
+        """
+        scores = np.asarray(scores, dtype=float).reshape(-1, len(self.impact_categories))
+        n = scores.shape[0]
+        sample_start = self._sample if sample_start is None else sample_start
+        self._sample = sample_start + n
+
+        values = [
+            np.arange(sample_start, sample_start + n),
+            np.full(n, -1 if seed is None else seed),
+            np.full(n, functional_unit),
+        ] + [scores[:, i] for i in range(scores.shape[1])]
+
+        shard_dir = self._get_shard_dir()
+        for (name, dtype), value in zip(self.columns, values):
+            with open(os.path.join(shard_dir, f"{name}.bin"), "ab") as file:
+                file.write(np.ascontiguousarray(value, dtype=dtype).tobytes())
+
+    @staticmethod
+    def load(directory: str, mmap: bool = True) -> dict:
+        """
+        Read the results of all shards.
+
+        Parameters:
+            * directory: The directory of the shards.
+            * mmap: If True and there is only one shard already in sample order, the columns are memory maps instead of arrays in memory.
+
+        Returns:
+            * dict: Return the columns {"sample", "seed", "functional_unit", <impact category>: np.ndarray}, sorted by sample index.
+        """
+        shards = []
+        for shard in sorted(os.listdir(directory)):
+            schema_file = os.path.join(directory, shard, "schema.json")
+            if not os.path.exists(schema_file):
+                continue
+            with open(schema_file, "r") as file:
+                schema = json.load(file)
+            files = [(column["name"], np.dtype(column["dtype"]), os.path.join(directory, shard, f"{column['name']}.bin")) for column in schema["columns"]]
+            rows = min(os.path.getsize(path) // dtype.itemsize if os.path.exists(path) else 0 for _, dtype, path in files)
+            if rows == 0:
+                continue
+            columns = {name: np.memmap(path, dtype=dtype, mode="r", shape=(rows,)) for name, dtype, path in files}
+            for i, impact_category in enumerate(schema["impact_categories"]):
+                columns[impact_category] = columns.pop(f"impact_{i}")
+            shards.append(columns)
+
+        if len(shards) == 0:
+            return {}
+        if len(shards) == 1 and mmap and np.all(np.diff(shards[0]["sample"]) >= 0):
+            return shards[0]
+        results = {name: np.concatenate([shard[name] for shard in shards]) for name in shards[0]}
+        order = np.argsort(results["sample"], kind="stable")
+
+        return {name: values[order] for name, values in results.items()}
+
+    @staticmethod
+    def to_csv(directory: str, filename: str, index_columns: bool = False):
+        """
+        Export the results of all shards to a csv file.
+
+        Parameters:
+            * directory: The directory of the shards.
+            * filename: The path of the csv file.
+            * index_columns: If False, only the impact categories are exported, which is the same format as CSVResultWriter.
+        """
+        results = pd.DataFrame(ResultWriter.load(directory, mmap=False))
+        if not index_columns:
+            results = results.drop(columns=[name for name, _ in ResultWriter.INDEX_COLUMNS])
+        results.to_csv(filename, index=False)
+
+
+class CSVResultWriter:
+    """
+    This class is used to write Monte Carlo results to a csv file, one row per sample and one column per impact category.
+    It has the same write method as ResultWriter, but it should only be used from one process.
+    """
+    def __init__(self, filename: str, impact_categories: list = None):
+        """
+        Parameters:
+            * filename: The path of the csv file, the file is overwritten.
+            * impact_categories: The list of impact categories, one column per impact category, by default ["kg CO2eq"].
+        """
+        self.filename = filename
+        self.impact_categories = ["kg CO2eq"] if impact_categories is None else list(impact_categories)
+        with open(filename, "w") as file:
+            file.write(",".join(self.impact_categories) + "\n")
+
+    def write(self, scores, seed: int = None, functional_unit: int = -1, sample_start: int = None):
+        """
+        Append a batch of results, the seed, functional unit and sample index are not saved in csv format.
+        """
+        df_batch = pd.DataFrame(np.asarray(scores, dtype=float).reshape(-1, len(self.impact_categories)), columns=self.impact_categories)
+        df_batch.to_csv(self.filename, mode="a", header=False, index=False)
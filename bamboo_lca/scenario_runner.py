@@ -0,0 +1,125 @@
+from scipy import sparse
+import pandas as pd
+import numpy as np
+from .technosphere_solver import TechnosphereSolver
+
+
+class ScenarioRunner:
+    """
+    This class is used to evaluate many scenarios of one base model, every scenario changes a small set of technosphere or biosphere coefficients.
+
+    A scenario is a patch of coefficients, every value replaces the value of the base matrix at (row, col):
+
+        {"technosphere": [(row, col, value), ...], "biosphere": [(row, col, value), ...]}
+
+    The technosphere is only factorized once. A technosphere patch changing k columns is a rank-k update (I-A)' = (I-A) + D E^T, which is solved
+    with the Sherman-Morrison-Woodbury formula: x' = x - Y (I + E^T Y)^-1 E^T x, where Y = (I-A)^-1 D needs k solves with the base factorization.
+    If k is larger than max_rank, the patched technosphere is factorized instead.
+    """
+    def __init__(self, A, B, C, demand, max_rank: int = 20, solver=None, backend: str = "superlu", methods: list = None):
+        """
+        Parameters:
+            * A: The technosphere matrix (I-A) in numpy or scipy sparse format, the same matrix LCAWrapper.manual_lca takes.
+            * B: The biosphere matrix.
+            * C: The characterization factor matrix, or a dictionary of characterization factor matrices {<impact name>: <matrix>}.
+            * demand: The index of the functional unit, or the demand vector.
+            * max_rank: The maximum number of changed technosphere columns to use a low-rank update, larger patches are factorized.
+            * solver: A TechnosphereSolver of A, by default A is factorized here.
+            * backend: The sparse LU backend, see TechnosphereSolver.
+            * methods: Set the method names if C is a characterization operator from BackgroundImporter.build_cf_operator (one row per method).
+        """
+        self.A = sparse.csc_array(A, dtype=float)
+        self.B = sparse.csr_array(B, dtype=float)
+        if methods is not None:
+            cf_operator = sparse.csr_array(C).toarray()
+            self.characterized = {name: cf_operator[i] for i, name in enumerate(methods)}
+        else:
+            C = {"score": C} if not isinstance(C, dict) else C
+            self.characterized = {name: np.asarray(sparse.csr_array(cf_matrix).sum(axis=0)).ravel() for name, cf_matrix in C.items()}
+        self.max_rank = max_rank
+        self.backend = backend
+        self.solver = TechnosphereSolver(self.A, backend) if solver is None else solver
+
+        if np.isscalar(demand):
+            index, demand = demand, np.zeros(self.A.shape[0])
+            demand[index] = 1
+        self.demand = np.asarray(demand, dtype=float)
+        self.x = self.solver.solve(self.demand)
+
+    def _get_delta(self, matrix, entries):
+        """
+        Get the change of a matrix as a sparse matrix, if a position is given several times, the last value is kept.
+        """
+        if entries is None or len(entries) == 0:
+            return None
+        entries = pd.DataFrame(list(entries), columns=["row", "col", "value"]).drop_duplicates(subset=["row", "col"], keep="last")
+        rows, cols = entries["row"].to_numpy(dtype=int), entries["col"].to_numpy(dtype=int)
+        out_of_range = (rows < 0) | (rows >= matrix.shape[0]) | (cols < 0) | (cols >= matrix.shape[1])
+        if out_of_range.any():
+            raise ValueError(f"Patch position(s) out of the matrix {matrix.shape}: {list(zip(rows[out_of_range], cols[out_of_range]))[:5]}")
+
+        base_values = np.asarray(matrix[rows, cols]).ravel()
+        delta = sparse.csc_array((entries["value"].to_numpy(dtype=float) - base_values, (rows, cols)), shape=matrix.shape)
+        delta.eliminate_zeros()
+
+        return delta
+
+    def _solve_patched(self, delta):
+        """
+        Solve the patched technosphere system, with a low-rank update of the base factorization or with a new factorization.
+        """
+        if delta is None:
+            return self.x
+
+        cols = np.flatnonzero(np.diff(delta.indptr))
+        if len(cols) <= self.max_rank:
+            y = self.solver.solve(delta[:, cols].toarray())
+            y = y.reshape(len(self.x), len(cols))
+            capacitance = np.eye(len(cols)) + y[cols, :]
+            try:
+                return self.x - y @ np.linalg.solve(capacitance, self.x[cols])
+            except np.linalg.LinAlgError:
+                print("The low-rank update is singular, the patched technosphere is factorized instead.")
+
+        return TechnosphereSolver(self.A + delta, self.backend).solve(self.demand)
+
+    def evaluate(self, patch: dict) -> dict:
+        """
+        Evaluate one scenario.
+
+        Parameters:
+            * patch: The coefficients changed by the scenario, {"technosphere": [(row, col, value), ...], "biosphere": [(row, col, value), ...]}.
+
+        Returns:
+            * dict: Return the score of every impact, {<impact name>: <score>}.
+        """
+        unsupported = [name for name in patch if name not in ["technosphere", "biosphere"]]
+        if unsupported:
+            raise ValueError(f"Patch matrix {unsupported} is not supported, supported matrices: technosphere, biosphere.")
+
+        x = self._solve_patched(self._get_delta(self.A, patch.get("technosphere")))
+        inventory = self.B @ x
+        bio_delta = self._get_delta(self.B, patch.get("biosphere"))
+        if bio_delta is not None:
+            inventory = inventory + bio_delta @ x
+
+        return {name: float(characterized @ inventory) for name, characterized in self.characterized.items()}
+
+    def run(self, scenarios: dict, include_base: bool = True) -> pd.DataFrame:
+        """
+        Evaluate all scenarios.
+
+        Parameters:
+            * scenarios: The scenarios {<scenario name>: <patch>}, see evaluate.
+            * include_base: Set to True to add the base model as the first row, named "base".
+
+        Returns:
+            * pd.DataFrame: Return the scenario x impact result table.
+        """
+        results = {}
+        if include_base:
+            results["base"] = self.evaluate({})
+        for name, patch in scenarios.items():
+            results[name] = self.evaluate(patch)
+
+        return pd.DataFrame.from_dict(results, orient="index")
@@ -0,0 +1,77 @@
+from scipy.sparse import linalg
+from scipy import sparse
+import numpy as np
+
+
+class TechnosphereSolver:
+    """
+    This class is used to factorize the technosphere matrix (I-A) once, and then answer many queries with cheap triangular solves.
+
+    Supported backends:
+        * "superlu": scipy SuperLU, always available (default).
+        * "umfpack": UMFPACK, requires scikit-umfpack.
+        * "pardiso": Intel PARDISO, requires pypardiso.
+    If the chosen backend is not installed, SuperLU is used instead.
+    """
+    def __init__(self, A, backend: str = "superlu"):
+        """
+        Parameters:
+            * A: The technosphere matrix (I-A) in numpy or scipy sparse format, the same matrix manual_lca takes.
+            * backend: The sparse LU backend, "superlu", "umfpack" or "pardiso".
+        """
+        self.matrix = sparse.csc_array(A, dtype=float)
+        self.backend = backend
+        self._lu = None
+        self._solve = self._factorize(self.matrix, backend)
+        self._solve_transposed = None
+
+    def _factorize(self, matrix, backend):
+        """
+        Factorize the matrix with the chosen backend and return the solve function.
+        """
+        if backend == "umfpack":
+            try:
+                from scikits import umfpack
+                return umfpack.splu(matrix).solve
+            except ImportError:
+                print("scikit-umfpack is not installed, SuperLU is used instead.")
+        elif backend == "pardiso":
+            try:
+                import pypardiso
+                return pypardiso.factorized(sparse.csr_matrix(matrix))
+            except ImportError:
+                print("pypardiso is not installed, SuperLU is used instead.")
+        elif backend != "superlu":
+            print(f'Backend {backend} is not supported, please set the backend to "superlu", "umfpack" or "pardiso". SuperLU is used instead.')
+
+        self.backend = "superlu"
+        self._lu = linalg.splu(matrix)
+
+        return self._lu.solve
+
+    def solve(self, demand):
+        """
+        Solve (I-A) x = f.
+
+        Parameters:
+            * demand: The functional unit vector f, or a matrix with one functional unit per column.
+
+        Returns:
+            * np.ndarray: Return the scaling vector x (or one per column).
+        """
+        return self._solve(np.asarray(demand, dtype=float))
+
+    def solve_transposed(self, demand):
+        """
+        Solve (I-A)^T y = f, used to get the results of all activities at once.
+
+        Parameters:
+            * demand: The right-hand side vector, or a matrix with one right-hand side per column.
+        """
+        demand = np.asarray(demand, dtype=float)
+        if self._lu is not None:
+            return self._lu.solve(demand, trans="T")
+        if self._solve_transposed is None:  # other backends factorize the transposed matrix once
+            self._solve_transposed = self._factorize(sparse.csc_array(self.matrix.T), self.backend)
+
+        return self._solve_transposed(demand)
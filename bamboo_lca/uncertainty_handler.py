@@ -2,11 +2,16 @@ import bw_processing as bwp
 import pandas as pd
 import numpy as np
 from .metadata_manager import *
+from .instrumentation import instrumented
 
 
 class UncertaintyHandler:
-    def __init__(self):
-        self.metadata = metadata_manager._get_metadata()
+    def __init__(self, metadata=None):
+        """
+        Parameters:
+            * metadata: The uncertainty metadata, either an UncertaintyMetadata or a dictionary in MetadataManager format. By default, the metadata of metadata_manager is used.
+        """
+        self.metadata = metadata_manager._get_metadata() if metadata is None else metadata
 
     def _calc_specific_uncertainty(self, data, uncertainty):
         loc = np.log(data)
@@ -38,60 +43,81 @@ class UncertaintyHandler:
             uncertainty_tuple = (type, np.nan, np.nan, np.nan, (data - data * gsd), (data + data * gsd), uncertainty_negative)
 
         return uncertainty_tuple
-    
-    def _get_uncertainty_value(self, strategy, act_index, row):
+
+    def _generate_uncertainty_array(self, data, type, gsd, uncertainty_negative):
         """
-        Get uncertainty values by strategy from metadata.
+        Generate the uncertainty array for many values at once, follows the same rules as _generate_uncertainty_tuple.
 
         Parameters:
-            * strategy: The strategy of adding uncertainty, "itemwise" or "columnwise".
-            * act_index: The index of the activity.
-            * row: The row number of the corresponding activity.
+            * data: The input or output values of the exchanges in the system.
+            * type: The type of uncertainty, one value for all exchanges or one value per exchange.
+            * gsd: Geometric Standard Deviation, one value for all exchanges or one value per exchange.
+            * uncertainty_negative: uncertainty negative, one value for all exchanges or one value per exchange.
         """
-        if self.metadata is None:
-            print("Please write your uncertainty information into metadata first.")
-        
-        if len(self.metadata) <= row:  # If biosphere, indices need to be subtracted from technosphere indices.
-            row = row - len(self.metadata) + 1
-
-        if strategy == "itemwise":
-            specific = self.metadata[act_index].get("Exchange uncertainty amount", 0)
-            if isinstance(specific, list):
-                uncertainty_value = specific[row]
-            else:  # because some activity don't have uncertainty at all, in this case is background system
-                uncertainty_value = specific
-        elif strategy == "columnwise":
-            uncertainty_value = self.metadata[act_index].get("Exchange uncertainty amount", 0)
-            uncertainty_value = 0 if np.isnan(uncertainty_value) else uncertainty_value
-
-        return uncertainty_value
+        data = np.abs(np.asarray(data, dtype=float))
+        type, gsd, uncertainty_negative = [np.broadcast_to(np.asarray(value), data.shape) for value in (type, gsd, uncertainty_negative)]
+        unsupported = ~np.isin(type, [0, 1, 2, 3, 4])
+        if unsupported.any():
+            raise ValueError(f"Uncertainty type {np.unique(type[unsupported]).tolist()} is not supported, supported types: 0, 1, 2, 3, 4.")
+
+        gsd = gsd.astype(float)
+        uncertainty_array = np.empty(len(data), dtype=bwp.UNCERTAINTY_DTYPE)
+        uncertainty_array["uncertainty_type"] = type
+        uncertainty_array["loc"] = data
+        uncertainty_array["scale"] = np.nan
+        uncertainty_array["shape"] = np.nan
+        uncertainty_array["minimum"] = np.nan
+        uncertainty_array["maximum"] = np.nan
+        uncertainty_array["negative"] = uncertainty_negative
+
+        lognormal = type == 2  # no need to consider data == 0, because sparse matrix only save non-zero values.
+        uncertainty_array["uncertainty_type"][lognormal & (gsd == 0)] = 0
+        lognormal &= gsd != 0
+        with np.errstate(divide="ignore", invalid="ignore"):
+            uncertainty_array["loc"][lognormal] = np.log(data[lognormal])
+            uncertainty_array["scale"][lognormal] = np.log(gsd[lognormal])
+
+        uniform = type == 4
+        uncertainty_array["loc"][uniform] = np.nan
+        uncertainty_array["minimum"][uniform] = data[uniform] - data[uniform] * gsd[uniform]
+        uncertainty_array["maximum"][uniform] = data[uniform] + data[uniform] * gsd[uniform]
+
+        return uncertainty_array
     
-    def _get_uncertainty_negative(self, strategy, act_index, row):
+    def _get_metadata_store(self):
+        """
+        Get the metadata in columnar format, the dictionary metadata of metadata_manager is converted on the fly.
+        """
+        if isinstance(self.metadata, UncertaintyMetadata):
+            return self.metadata
+
+        return UncertaintyMetadata.from_metadata(self.metadata)
+
+    def _get_uncertainty_values(self, store, itemwise, rows, cols):
         """
-        Get uncertainty negative (TRUE or FALSE) by strategy from metadata.
+        Get uncertainty values and uncertainty negatives of many exchanges from metadata.
 
         Parameters:
-            * strategy: The strategy of adding uncertainty, "itemwise" or "columnwise" (If strategy is "Uniform", don't need to call this function).
-            * act_index: The index of the activity.
-            * row: The row number of the corresponding activity.
+            * store: The metadata in columnar format.
+            * itemwise: A boolean array, True if the exchange uses the "itemwise" strategy, False if it uses the "columnwise" strategy.
+            * rows: The row numbers of the exchanges.
+            * cols: The indices of the activities.
         """
-        if self.metadata is None:
-            print("Please write your uncertainty information into metadata first.")
-        
-        if len(self.metadata) <= row:  # If biosphere, indices need to be subtracted from technosphere indices.
-            row = row - len(self.metadata) + 1
+        _, column_gsd, column_negative = store.get_column_values(cols)
+        uncertainty_value = np.where(np.isnan(column_gsd), 0, column_gsd)
+        uncertainty_negative = column_negative.copy()
 
-        if strategy == "itemwise":
-            specific = self.metadata[act_index].get("Exchange negative", False)
-            if isinstance(specific, list):
-                uncertainty_negative = specific[row]
-            else:  # because some activity don't have uncertainty at all, in this case is background system
-                uncertainty_negative = specific
-        elif strategy == "columnwise":
-            uncertainty_negative = self.metadata[act_index].get("Exchange negative", False)
+        # for itemwise, columns without itemwise values (e.g. background system) use their column values as they are.
+        uncertainty_value[itemwise] = column_gsd[itemwise]
+        itemwise = itemwise & store.itemwise[cols]
+        rows = np.where(rows >= len(store), rows - len(store) + 1, rows)  # If biosphere, indices need to be subtracted from technosphere indices.
+        item_gsd, item_negative = store.get_item_values(rows[itemwise], cols[itemwise])
+        uncertainty_value[itemwise] = item_gsd
+        uncertainty_negative[itemwise] = item_negative
 
-        return uncertainty_negative
+        return uncertainty_value, uncertainty_negative
 
+    @instrumented()
     def add_nonuniform_uncertainty(self, bw_data, bw_indices, bg_strategy, fg_num=None, fg_strategy=None):
         """
         Prepare uncertainty array for datapackage. By default, foreground system is not considered, but you can set youself.
@@ -99,7 +125,6 @@ class UncertaintyHandler:
         Parameters:
             * bw_data: One of the technosphere/bioshphere/characterization factor matrix in datapackage needed format.
             * bw_indices: Matrix indices in datapackage needed format.
-            * bw_flip: Flip array of technosphere in datapackage needed format.
             * bg_strategy: The uncertainty stragegy for one matrix in background system, two options available: "itemwise" and "columnwise"
             * fg_num: The number of columns in the foreground system.
             * fg_strategy: The uncertainty stragegy fsor one matrix in foreground system, two options available: "itemwise" and "columnwise"
@@ -107,26 +132,27 @@ class UncertaintyHandler:
         if self.metadata is None:
             print("Please write your uncertainty information into metadata first.")
 
-        uncertainty_array = []
-        for i, data in enumerate(bw_data):
-            row, col = bw_indices[i]
-            act_index = col
-            uncertainty_type = self.metadata[act_index].get("Activity uncertainty type", 0)
-            if fg_num is not None and fg_strategy is not None:
-                if act_index < fg_num: # foreground situation
-                    strategy = fg_strategy
-                else:
-                    strategy = bg_strategy
-            else:
-                strategy = bg_strategy
-            
-            uncertainty_array.append(self._generate_uncertainty_tuple(data, uncertainty_type, self._get_uncertainty_value(strategy, act_index, row), self._get_uncertainty_negative(strategy, act_index, row)))
+        store = self._get_metadata_store()
+        rows = np.asarray(bw_indices["row"], dtype=np.int64)
+        cols = np.asarray(bw_indices["col"], dtype=np.int64)
+
+        for strategy in [bg_strategy, fg_strategy]:
+            if strategy not in ["itemwise", "columnwise", None]:
+                raise ValueError(f"Strategy {strategy} is not supported, you should either choose 'columnwise' or 'itemwise'")
 
-        return np.array(uncertainty_array, dtype=bwp.UNCERTAINTY_DTYPE)
+        itemwise = np.full(len(cols), bg_strategy == "itemwise")
+        if fg_num is not None and fg_strategy is not None:
+            itemwise[cols < fg_num] = fg_strategy == "itemwise"  # foreground situation
+
+        uncertainty_type = store.get_column_values(cols)[0]
+        uncertainty_value, uncertainty_negative = self._get_uncertainty_values(store, itemwise, rows, cols)
+
+        return self._generate_uncertainty_array(bw_data, uncertainty_type, uncertainty_value, uncertainty_negative)
     
+    @instrumented()
     def add_uniform_uncertainty(self, type, gsd, uncertainty_negative, bw_data, bw_flip=None):
         """
-        Generate the uncertainty tuple for one value.
+        Generate the uncertainty array for all values, the same uncertainty is used for every exchange.
 
         Parameters:
             * type: The type of uncertainty, such as 0, 1, 2, 3, 4.
@@ -134,16 +160,11 @@ class UncertaintyHandler:
             * bw_data: All values for foreground system or background system.
             * bw_flip: The flip array of technosphere.
         """
-        uncertainty_array = []
-
-        if bw_flip is not None:
-            for i in range(len(bw_data)):
-                if bw_flip[i] == True:
-                    uncertainty_array.append(self._generate_uncertainty_tuple(bw_data[i], type, gsd, uncertainty_negative))
-                else:
-                    uncertainty_array.append((0, bw_data[i], np.nan, np.nan, np.nan, np.nan, False))
-        else:
-            for i in range(len(bw_data)):
-                uncertainty_array.append(self._generate_uncertainty_tuple(bw_data[i], type, gsd, uncertainty_negative))
-
-        return np.array(uncertainty_array, dtype=bwp.UNCERTAINTY_DTYPE)
\ No newline at end of file
+        uncertainty_array = self._generate_uncertainty_array(bw_data, type, gsd, uncertainty_negative)
+
+        if bw_flip is not None:  # exchanges which are not flipped (the diagonal) don't have uncertainty.
+            no_flip = ~np.asarray(bw_flip, dtype=bool)
+            uncertainty_array[no_flip] = (0, np.nan, np.nan, np.nan, np.nan, np.nan, False)
+            uncertainty_array["loc"][no_flip] = np.asarray(bw_data, dtype=float)[no_flip]
+
+        return uncertainty_array
\ No newline at end of file
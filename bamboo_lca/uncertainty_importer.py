@@ -1,13 +1,21 @@
 import pandas as pd
+import numpy as np
 from .metadata_manager import *
+from .instrumentation import instrumented
 
 
 class UncertaintyImporter:
     """
-    The metadata updated in this class will be stored in metadata_manager
+    The metadata updated in this class will be stored in the given metadata, by default in metadata_manager.
     """
-    def __init__(self, file_path, delimiter):
-        self.metadata = metadata_manager._get_metadata()
+    def __init__(self, file_path, delimiter, metadata=None):
+        """
+        Parameters:
+            * file_path: The path of the uncertainty file.
+            * delimiter: The delimiter of the uncertainty file.
+            * metadata: The metadata to fill, either an UncertaintyMetadata or a dictionary in MetadataManager format. By default, the metadata of metadata_manager is used.
+        """
+        self.metadata = metadata_manager._get_metadata() if metadata is None else metadata
         self.file_path = file_path
         self.delimiter = delimiter
         self.df = None
@@ -16,54 +24,108 @@ class UncertaintyImporter:
         if self.df is None:
             self.df = pd.read_csv(self.file_path, delimiter=self.delimiter)
 
+    @instrumented()
     def update_metadata_uncertainty(self, activities, strategy):  # TODO: What if they have the same name?
         """
+        Update the metadata of all activities of the uncertainty file in one grouped pass.
+
+        An activity is updated if one of its exchanges is an activity of the metadata, its uncertainty type comes from its production exchange
+        (the exchange with its own name). "columnwise" also takes the GSD and negative of the production exchange,
+        "itemwise" takes one GSD and negative per activity (0 and False if the activity is not an exchange).
+
         Parameters:
+            * activities: The list of all activities, the same order as the columns of the technosphere matrix.
             * strategy: "itemwise" or "columnwise"
         """
         self._update_metadata_activities(activities)
 
         self._load_df()
-        column_names = self.df["Activity name"].unique()  # the column names of foreground system
-        for col_name in column_names:
-            self._update_metadata_column_uncertainty(col_name, self.df, activities, strategy)
+        if strategy not in ["itemwise", "columnwise"]:
+            print(F"Strategy {strategy} is not supported, you should either choose 'columnwise' or 'itemwise'")
+            return
 
-    def _update_metadata_activities(self, activities):
+        df = self.df[["Activity name", "Exchange name", "Exchange uncertainty type", "GSD", "Exchange negative"]]
+        duplicated = df.duplicated(subset=["Activity name", "Exchange name"])
+        if duplicated.any():
+            raise ValueError(f"Exchange(s) given several times for the same activity: {df.loc[duplicated, ['Activity name', 'Exchange name']].values.tolist()[:5]}")
+
+        # an activity is updated if one of its exchanges is an activity of the metadata.
+        metadata_names = set(activities)
+        updated = df["Exchange name"].isin(metadata_names).groupby(df["Activity name"], sort=False).any()
+        act_names = updated.index[updated.to_numpy()]
+        if len(act_names) == 0:
+            return
+
+        positions = {}
+        for i, activity in enumerate(activities):
+            positions.setdefault(activity, i)
+        missing = [act_name for act_name in act_names if act_name not in positions]
+        if missing:
+            raise ValueError(f"Activity(s) {missing[:5]} of the uncertainty file are not in the activities.")
+
+        production = df[df["Activity name"] == df["Exchange name"]].set_index("Activity name")
+        missing = [act_name for act_name in act_names if act_name not in production.index]
+        if missing:
+            raise ValueError(f"Activity(s) {missing[:5]} of the uncertainty file have no production exchange (an exchange with the activity name).")
+        production = production.loc[act_names]
+        uncertainty_types = production["Exchange uncertainty type"].to_list()
+
+        if strategy == "itemwise":
+            item_tables = self._get_item_tables(df[df["Activity name"].isin(act_names)], act_names, activities)
+            for act_name, uncertainty_type, (gsd_list, negative_list) in zip(act_names, uncertainty_types, item_tables):
+                self._update_activity(positions[act_name], uncertainty_type, gsd_list, negative_list)
+        else:
+            for act_name, uncertainty_type, gsd, negative in zip(act_names, uncertainty_types, production["GSD"].to_list(), production["Exchange negative"].to_list()):
+                self._update_activity(positions[act_name], uncertainty_type, gsd, negative)
+
+    def _update_activity(self, index, uncertainty_type, gsd, negative):
         """
-        Import all foreground activity names, if foreground system has 2 columns, it will have 2 keys.
+        Set the uncertainty of one activity, gsd and negative are lists for itemwise (one value per row), or single values for columnwise.
         """
-        if not any("Activity name" in value for value in self.metadata.values()):
-            for i in range(len(activities)):
-                metadata_manager._update_metadata(i, {"Activity name": activities[i]})
+        if isinstance(self.metadata, UncertaintyMetadata):
+            if isinstance(gsd, list):
+                self.metadata.update_items(index, uncertainty_type, gsd, negative)
+            else:
+                self.metadata.update_column(index, uncertainty_type, gsd, bool(negative))
+            return
+
+        self.metadata[index]["Activity uncertainty type"] = uncertainty_type
+        self.metadata[index]["Exchange uncertainty amount"] = gsd
+        self.metadata[index]["Exchange negative"] = negative
 
-    def _update_metadata_column_uncertainty(self, act_name, df, activities, strategy):
+    def _get_item_tables(self, df, act_names, activities):
         """
-        Update metadata by "Activity name"
+        Get the itemwise GSD list and negative list of every activity, the lists follow the order of activities.
+        GSDs of exchanges that are not activities are ignored, missing GSDs are 0 and missing negatives are False.
         """
-        selected_df = df.loc[df["Activity name"] == act_name, ["Exchange name", "Exchange uncertainty type", "GSD", "Exchange negative"]]
-        selected_dict = selected_df.set_index("Exchange name")[["Exchange uncertainty type", "GSD", "Exchange negative"]].to_dict(orient="index")
+        targets = pd.DataFrame({"Exchange name": activities, "position": range(len(activities))})
+        items = df.reset_index(drop=True).merge(targets, on="Exchange name", how="inner")
+        groups = pd.Series(range(len(act_names)), index=act_names)
+        items_group = groups.loc[items["Activity name"]].to_numpy()
+        items_gsd = items["GSD"].astype(float).fillna(0).to_numpy()
+        items_negative = items["Exchange negative"].replace(0, False).astype(bool).to_numpy()
 
-        if strategy == "itemwise":
-            selected_df_2 = selected_df.set_index("Exchange name")[["Exchange uncertainty type", "GSD", "Exchange negative"]]
-            selected_df_2 = selected_df_2.reindex(activities, fill_value=0)
-            gsd_list = selected_df_2["GSD"].astype(float).fillna(0).tolist()
-            negative_list = selected_df_2["Exchange negative"].replace(0, False).astype(bool).fillna(False).tolist()
-            for key, value in self.metadata.items():
-                activity_name = value["Activity name"]
-                if activity_name in selected_dict:
-                    index = activities.index(act_name)
-                    uncertainty_type = selected_df[selected_df["Exchange name"] == act_name]["Exchange uncertainty type"].to_list()[0]
-                    self.metadata[index]["Activity uncertainty type"] = uncertainty_type
-                    self.metadata[index]["Exchange uncertainty amount"] = gsd_list
-                    self.metadata[index]["Exchange negative"] = negative_list
-        elif strategy == "columnwise":
-            for key, value in self.metadata.items():
-                activity_name = value["Activity name"]
-                if activity_name in selected_dict:
-                    index = activities.index(act_name)
-                    uncertainty_type = selected_df[selected_df["Exchange name"] == act_name]["Exchange uncertainty type"].to_list()[0]
-                    self.metadata[index]["Activity uncertainty type"] = uncertainty_type
-                    self.metadata[index]["Exchange uncertainty amount"] = selected_df[selected_df["Exchange name"] == act_name]["GSD"].to_list()[0]
-                    self.metadata[index]["Exchange negative"] = selected_df[selected_df["Exchange name"] == act_name]["Exchange negative"].to_list()[0]
-        else:
-            print(F"Strategy {strategy} is not supported, you should either choose 'columnwise' or 'itemwise'")
\ No newline at end of file
+        order = np.argsort(items_group, kind="stable")
+        bounds = np.searchsorted(items_group[order], np.arange(len(act_names) + 1))
+        positions = items["position"].to_numpy()
+        for i in range(len(act_names)):
+            selected = order[bounds[i]:bounds[i + 1]]
+            gsd_list, negative_list = np.zeros(len(activities)), np.zeros(len(activities), dtype=bool)
+            gsd_list[positions[selected]] = items_gsd[selected]
+            negative_list[positions[selected]] = items_negative[selected]
+            yield gsd_list.tolist(), negative_list.tolist()
+
+    def _update_metadata_activities(self, activities):
+        """
+        Import all activity names, one key per activity.
+        If the metadata was filled for other activities (another model), it is reset, so the uncertainty of the other model is not kept.
+        """
+        if isinstance(self.metadata, UncertaintyMetadata):
+            if self.metadata.activities != list(activities):
+                raise ValueError(f"The activities of the metadata ({len(self.metadata)}) are not the given activities ({len(activities)}), please create the UncertaintyMetadata with the same activities.")
+            return
+
+        if [self.metadata.get(i, {}).get("Activity name") for i in range(len(self.metadata))] != list(activities):
+            self.metadata.clear()
+            for i in range(len(activities)):
+                self.metadata[i] = {"Activity name": activities[i]}
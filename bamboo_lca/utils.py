@@ -1,6 +1,8 @@
 import bw_processing as bwp
+from scipy import sparse, special
 import pandas as pd
 import numpy as np
+from .instrumentation import instrumented
 
 
 def detect_foreground(acts, bg_activities):
@@ -63,6 +65,116 @@ def get_bg_activities(a_file_path: str, delimiter: str) -> list:
 
     return activities
 
+@instrumented()
+def read_exiobase_a(a_file_path: str, delimiter: str = "\t", chunksize: int = 1000):
+    """
+    Design for EXIOBASE: Stream the A.txt file in chunks, collect the activity names and the non-zero values in a single pass.
+
+    Parameters:
+        * a_file_path: The path to the file that needs to be processed.
+        * delimiter: The separator of the file.
+        * chunksize: The number of rows parsed at a time.
+
+    Returns:
+        * tuple: Return the activity names (<country_name>-<sector_name>), the (row, col, value) arrays of the non-zero values and the shape of the matrix.
+    """
+    activities, rows, cols, values = [], [], [], []
+    row_offset, col_num = 0, 0
+    reader = pd.read_csv(a_file_path, delimiter=delimiter, header=None, skiprows=3, dtype={0: str, 1: str}, float_precision="round_trip", chunksize=chunksize)
+    for chunk in reader:
+        activities.extend((chunk.iloc[:, 0] + "-" + chunk.iloc[:, 1]).to_list())
+        chunk_values = chunk.iloc[:, 2:].to_numpy(dtype=float)
+        chunk_rows, chunk_cols = np.nonzero(chunk_values)
+        rows.append(chunk_rows + row_offset)
+        cols.append(chunk_cols)
+        values.append(chunk_values[chunk_rows, chunk_cols])
+        row_offset += chunk_values.shape[0]
+        col_num = chunk_values.shape[1]
+
+    return activities, (np.concatenate(rows), np.concatenate(cols), np.concatenate(values)), (row_offset, col_num)
+
+@instrumented()
+def read_exiobase_s(s_file_path: str, emissions: list, delimiter: str = "\t", chunksize: int = 1000):
+    """
+    Design for EXIOBASE: Stream the S.txt file in chunks, collect the non-zero values of the chosen emissions in a single pass.
+
+    Parameters:
+        * s_file_path: The path to the file that needs to be processed.
+        * emissions: The list of emissions used for LCA calculation, the rows are returned in this order.
+        * delimiter: The separator of the file.
+        * chunksize: The number of rows parsed at a time.
+
+    Returns:
+        * tuple: Return the (row, col, value) arrays of the non-zero values and the shape of the matrix.
+    """
+    emission_rows = {emission: i for i, emission in enumerate(emissions)}
+    rows, cols, values = [], [], []
+    found, col_num = set(), 0
+    reader = pd.read_csv(s_file_path, delimiter=delimiter, header=None, skiprows=3, dtype={0: str}, chunksize=chunksize)
+    for chunk in reader:
+        col_num = chunk.shape[1] - 1
+        selected = chunk[chunk.iloc[:, 0].isin(emission_rows)]
+        if selected.empty:
+            continue
+        found.update(selected.iloc[:, 0])
+        chunk_values = selected.iloc[:, 1:].to_numpy(dtype=float)
+        chunk_rows, chunk_cols = np.nonzero(chunk_values)
+        rows.append(selected.iloc[:, 0].map(emission_rows).to_numpy()[chunk_rows])
+        cols.append(chunk_cols)
+        values.append(chunk_values[chunk_rows, chunk_cols])
+
+    missing = [emission for emission in emissions if emission not in found]
+    if missing:
+        raise ValueError(f"Emission(s) not found in {s_file_path}: {missing}")
+
+    return (np.concatenate(rows), np.concatenate(cols), np.concatenate(values)), (len(emissions), col_num)
+
+def get_manual_tech_matrix(tech_matrix):
+    """
+    Convert the totally positive technosphere matrix (from build_tech_matrix) into (I-A), the matrix used by LCAWrapper.manual_lca.
+
+    Parameters:
+        * tech_matrix: The technosphere matrix in numpy or scipy sparse format.
+    """
+    if sparse.issparse(tech_matrix):
+        tech_matrix = sparse.csr_array(tech_matrix)
+        diagonal = tech_matrix.diagonal()
+        return sparse.diags_array(2 * diagonal, format="csr") - tech_matrix
+
+    manual_tech_matrix = -tech_matrix
+    np.fill_diagonal(manual_tech_matrix, tech_matrix.diagonal())
+
+    return manual_tech_matrix
+
+def sample_uncertainty(params, uniforms):
+    """
+    Map uniform random numbers through the inverse CDF of the stats_arrays distributions: types 0 and 1 are fixed at loc, 2 lognormal (with the negative flag), 3 normal, 4 uniform.
+
+    Parameters:
+        * params: The uncertainty array (bwp.UNCERTAINTY_DTYPE) of the uncertain values.
+        * uniforms: The uniform random numbers in [0, 1), one row per iteration and one column per uncertain value.
+
+    Returns:
+        * np.ndarray: Return the sampled values, the same shape as uniforms.
+    """
+    uniforms = np.clip(uniforms, np.finfo(float).tiny, 1 - np.finfo(float).eps)
+    uncertainty_type = params["uncertainty_type"]
+    samples = np.empty_like(uniforms)
+
+    fixed = uncertainty_type < 2
+    samples[:, fixed] = params["loc"][fixed]
+    normal = np.isin(uncertainty_type, [2, 3])
+    z = special.ndtri(uniforms[:, normal])
+    samples[:, normal] = params["loc"][normal] + params["scale"][normal] * z
+    lognormal = uncertainty_type == 2
+    samples[:, lognormal] = np.exp(samples[:, lognormal])
+    samples[:, lognormal & params["negative"]] *= -1
+
+    uniform = uncertainty_type == 4
+    samples[:, uniform] = params["minimum"][uniform] + uniforms[:, uniform] * (params["maximum"][uniform] - params["minimum"][uniform])
+
+    return samples
+
 def file_preprocessing(file_name, delimiter: str, column_name: str, expacted_order: list):
     """
     Preprocess a file and return a DataFrame with the desired order.
@@ -89,13 +201,24 @@ def map_pedigree_uncertainty(country_file, sector_file, region_sector_file):
     """
     country_data = pd.read_csv(country_file, delimiter=";").fillna("").to_numpy()
     sector_data = pd.read_csv(sector_file, delimiter=";").fillna("").to_numpy()
-    region_sector_data = pd.read_csv(region_sector_file, delimiter=";").fillna("").to_numpy()
+    region_sector_data = pd.read_csv(region_sector_file, delimiter=";").fillna("")
 
     country_region = {row[0]: row[1] for row in country_data}
     sector_seccat = {row[0]: row[1] for row in sector_data}
 
     return country_region, sector_seccat, region_sector_data
 
+def get_pedigree_lookup(region_sector_dfs) -> dict:
+    """
+    Design for case study: Build the (region category, sector category) -> GSD lookup, if a pair is given several times, the first GSD is kept like find_pedigree_uncertainty.
+
+    Parameters:
+        * region_sector_dfs: The mapping from aggregated region and sector to GSD, from map_pedigree_uncertainty.
+    """
+    pairs = region_sector_dfs.drop_duplicates(subset=list(region_sector_dfs.columns[:2]), keep="first")
+
+    return dict(zip(zip(pairs.iloc[:, 0], pairs.iloc[:, 1]), pairs["GSD"].astype(float)))
+
 def find_pedigree_uncertainty(activity, country_region, sector_seccat, region_sector_dfs):
     """
     Design for case study: Search for pedigree uncertainty for specific activity or biosphere flow.
@@ -112,64 +235,92 @@ def find_pedigree_uncertainty(activity, country_region, sector_seccat, region_se
 
     return gsd
 
+def find_pedigree_uncertainties(activities: list, country_region, sector_seccat, region_sector_dfs) -> np.ndarray:
+    """
+    Design for case study: Search for pedigree uncertainty of all activities at once, the (region, sector category) lookup is only built once.
+
+    Parameters:
+        * activities: The activity names, "<country>-<sector>".
+        * country_region: The country to region mapping, from map_pedigree_uncertainty.
+        * sector_seccat: The sector to aggregated sector mapping, from map_pedigree_uncertainty.
+        * region_sector_dfs: The mapping from aggregated region and sector to GSD, from map_pedigree_uncertainty.
+
+    Returns:
+        * np.ndarray: Return the GSD of every activity, NaN if no GSD is found.
+    """
+    lookup = get_pedigree_lookup(region_sector_dfs)
+    countries, sectors = zip(*[get_country_sector(activity) for activity in activities]) if len(activities) > 0 else ((), ())
+    categories = zip(pd.Series(countries, dtype=object).map(country_region), pd.Series(sectors, dtype=object).map(sector_seccat))
+    gsd = np.array([lookup.get(category, np.nan) for category in categories], dtype=float)
+
+    missing = np.isnan(gsd)
+    if missing.any():
+        print(f"No GSD found for {missing.sum()} activities, for example: {[activities[i] for i in np.flatnonzero(missing)[:5]]}.")
+
+    return gsd
+
+def add_pedigree_uncertainty(bw_data, bw_indices, column_gsd, bw_flip=None, specific_gsd: dict = None) -> np.ndarray:
+    """
+    Design for case study: Add pedigree and specific uncertainty to all exchanges at once.
+
+    An exchange is lognormal (loc = log(|data|), scale = log(GSD)), except if its value or its GSD is 0, its GSD is missing,
+    or it is not flipped in the technosphere (bw_flip is False), then it is fixed at its value.
+
+    Parameters:
+        * bw_data: The values of the exchanges.
+        * bw_indices: The indices of the exchanges (bwp.INDICES_DTYPE).
+        * column_gsd: The GSD of every activity (column), NaN if there is no uncertainty, for example from find_pedigree_uncertainties.
+        * bw_flip: The flip array of the technosphere, None for the biosphere.
+        * specific_gsd: The specific GSDs of some columns {<column index>: [GSD, ...]}, one GSD per row, the exchange in row i of the column gets the i-th GSD
+            (the itemwise "Exchange uncertainty amount" layout of UncertaintyImporter).
+
+    Returns:
+        * np.ndarray: Return the uncertainty array (bwp.UNCERTAINTY_DTYPE).
+    """
+    data = np.asarray(bw_data, dtype=float)
+    rows = np.asarray(bw_indices["row"], dtype=np.int64)
+    cols = np.asarray(bw_indices["col"], dtype=np.int64)
+    gsd = np.asarray(column_gsd, dtype=float)[cols]
+
+    for col, values in (specific_gsd or {}).items():
+        positions = np.flatnonzero(cols == col)
+        values = np.asarray(values, dtype=float)
+        out_of_range = rows[positions] >= len(values)
+        if out_of_range.any():
+            raise ValueError(f"Column {col} has exchanges in rows {rows[positions][out_of_range][:5].tolist()}, but only {len(values)} specific GSDs.")
+        gsd[positions] = values[rows[positions]]
+
+    lognormal = ~np.isnan(gsd) & (gsd != 0) & (data != 0)
+    if bw_flip is not None:  # technosphere
+        lognormal &= np.asarray(bw_flip, dtype=bool)
+
+    uncertainty_array = np.empty(len(data), dtype=bwp.UNCERTAINTY_DTYPE)
+    uncertainty_array["uncertainty_type"] = np.where(lognormal, 2, 0)
+    uncertainty_array["loc"] = data
+    uncertainty_array["scale"] = np.nan
+    uncertainty_array["shape"] = np.nan
+    uncertainty_array["minimum"] = np.nan
+    uncertainty_array["maximum"] = np.nan
+    uncertainty_array["negative"] = False
+    uncertainty_array["loc"][lognormal] = np.log(np.abs(data[lognormal]))
+    uncertainty_array["scale"][lognormal] = np.log(gsd[lognormal])
+
+    return uncertainty_array
+
 def add_uncertainty(self, bw_data, bw_indices, bw_flip):
     """
-    Design for case study: Add pedigree and specific uncertainty
-    """
-    bw_uncertainties = []
-    if bw_flip is not None: # technosphere
-        k = 0
-        for data, indices, flip in zip(bw_data, bw_indices, bw_flip):
-            uncertainty = list(self.metadata[indices[1]].items())[0][1][1]
-            if uncertainty is not None:
-                if indices[1] == 0:
-                    uncertainty = uncertainty[k]
-                    k += 1
-                    if uncertainty == 0 or data == 0:
-                        parameters_a = (0, data, np.NaN, np.NaN, np.NaN, np.NaN, False)
-                    else:
-                        loc = np.log(abs(data))
-                        scale = np.log(uncertainty)
-                        if not flip:
-                            parameters_a = (0, data, np.NaN, np.NaN, np.NaN, np.NaN, False)
-                        else:
-                            parameters_a = (2, loc, scale, np.NaN, np.NaN, np.NaN, False)
-                else:
-                    if data == 0:
-                        parameters_a = (0, data, np.NaN, np.NaN, np.NaN, np.NaN, False)
-                    else:
-                        loc = np.log(abs(data))
-                        scale = np.log(uncertainty)
-                        if not flip:
-                            parameters_a = (0, data, np.NaN, np.NaN, np.NaN, np.NaN, False)
-                        else:
-                            parameters_a = (2, loc, scale, np.NaN, np.NaN, np.NaN, False)
-            else:
-                parameters_a = (0, data, np.NaN, np.NaN, np.NaN, np.NaN, False)
-            bw_uncertainties.append(parameters_a)
-    else:
-        k = 0
-        for data, indices in zip(bw_data, bw_indices):
-            uncertainty = list(self.metadata[indices[1]].items())[0][1][1]
-            if uncertainty is not None:
-                if indices[1] == 0:
-                    uncertainty = uncertainty[k]
-                    k += 1
-                    if uncertainty == 0 or data == 0:
-                        parameters_a = (0, data, np.NaN, np.NaN, np.NaN, np.NaN, False)
-                    else:
-                        loc = np.log(abs(data))
-                        scale = np.log(uncertainty)
-                        parameters_a = (2, loc, scale, np.NaN, np.NaN, np.NaN, False)
-                else:
-                    if data == 0:
-                        parameters_a = (0, data, np.NaN, np.NaN, np.NaN, np.NaN, False)
-                    else:
-                        loc = np.log(abs(data))
-                        scale = np.log(uncertainty)
-                        parameters_a = (2, loc, scale, np.NaN, np.NaN, np.NaN, False)
-            else:
-                parameters_a = (0, data, np.NaN, np.NaN, np.NaN, np.NaN, False)
-            bw_uncertainties.append(parameters_a)
-
-    return np.array(bw_uncertainties, dtype=bwp.UNCERTAINTY_DTYPE)
\ No newline at end of file
+    Design for case study: Add pedigree and specific uncertainty from the metadata, the columns with a list of "Exchange uncertainty amount" use the specific values.
+    """
+    column_gsd = np.full(int(np.max(bw_indices["col"], initial=-1)) + 1, np.nan)
+    specific_gsd = {}
+    for col, value in self.metadata.items():
+        uncertainty = value.get("Exchange uncertainty amount")
+        if col >= len(column_gsd) or uncertainty is None:
+            continue
+        if np.ndim(uncertainty) > 0:
+            specific_gsd[col] = uncertainty
+            column_gsd[col] = 1  # any non-zero value, replaced by the specific values
+        else:
+            column_gsd[col] = uncertainty
+
+    return add_pedigree_uncertainty(bw_data, bw_indices, column_gsd, bw_flip, specific_gsd)
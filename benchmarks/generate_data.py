@@ -0,0 +1,179 @@
+"""
+Deterministic generators of EXIOBASE-shaped input files, used by the benchmarks.
+
+The files have the same layout as the EXIOBASE A.txt/S.txt files and the foreground, uncertainty and characterization factor files in notebooks/data,
+so they can be read by the package without changes. The same arguments always give the same files.
+"""
+import numpy as np
+import pandas as pd
+import json
+import os
+
+
+def _get_rng(seed, name):
+    """
+    Get an independent random generator for every file, so changing one file's size doesn't change the others.
+    """
+    seed = list(seed) if isinstance(seed, (list, tuple)) else [seed]
+
+    return np.random.default_rng(seed + list(name.encode()))
+
+
+def _get_chunks(seed, name, shape, density, mean, sigma, row_chunk=500):
+    """
+    Yield the rows of a sparse random lognormal matrix chunk by chunk, every chunk has its own generator, so the chunks can be generated again
+    and the full dense matrix is never in memory.
+    """
+    for start in range(0, shape[0], row_chunk):
+        rng = _get_rng([seed, start], name)
+        size = (min(row_chunk, shape[0] - start), shape[1])
+        yield start, rng.lognormal(mean, sigma, size) * (rng.random(size) < density)
+
+
+def _write_table(file_path, header_lines, labels, chunks):
+    """
+    Write a tab separated table with header lines, label columns and the value chunks.
+    """
+    with open(file_path, "w") as file:
+        file.write("".join(line + "\n" for line in header_lines))
+        for start, values in chunks:
+            chunk = pd.concat([pd.DataFrame(labels[start:start + len(values)]), pd.DataFrame(values)], axis=1)
+            chunk.to_csv(file, sep="\t", header=False, index=False, float_format="%.6g")
+
+
+def generate_background(directory: str, num_regions: int = 2, num_sectors: int = 38, num_stressors: int = 1113, tech_density: float = 0.03, bio_density: float = 0.4, seed: int = 0):
+    """
+    Generate A.txt and S.txt in EXIOBASE format.
+
+    The technosphere has a non-zero diagonal, lognormal coefficients and column sums below 1 (a productive economy), the biosphere has a few negative values like EXIOBASE.
+
+    Parameters:
+        * directory: The directory to write the files.
+        * num_regions: The number of regions, EXIOBASE 3 has 49.
+        * num_sectors: The number of sectors per region, EXIOBASE 3 has 200 products.
+        * num_stressors: The number of stressors, EXIOBASE 3 has 1113.
+        * tech_density: The share of non-zero technosphere coefficients, the EXIOBASE 3 technosphere has less than 5%.
+        * bio_density: The share of non-zero biosphere coefficients.
+        * seed: The seed of the generators.
+
+    Returns:
+        * tuple: Return the list of activities and the list of stressors.
+    """
+    os.makedirs(directory, exist_ok=True)
+    regions = [f"R{i:02d}" for i in range(num_regions)]
+    sectors = [f"Sector {i:03d}" for i in range(num_sectors)]
+    labels = [(region, sector) for region in regions for sector in sectors]
+    stressors = [f"Stressor {i:04d} - air" for i in range(num_stressors)]
+    size = len(labels)
+
+    # the technosphere is generated twice: once for the column sums, once to write the scaled values.
+    rng = _get_rng(seed, "A")
+    diagonal = rng.uniform(0.01, 0.3, size)
+    column_scale = rng.uniform(0.3, 0.9, size)
+
+    def tech_chunks():
+        for start, values in _get_chunks(seed, "A", (size, size), tech_density, -6, 2):
+            rows = np.arange(start, start + len(values))
+            values[np.arange(len(values)), rows] = diagonal[rows]
+            yield start, values
+
+    column_sums = sum(values.sum(axis=0) for _, values in tech_chunks())
+    _write_table(
+        os.path.join(directory, "A.txt"),
+        ["region\t\t" + "\t".join(region for region, _ in labels), "sector\t\t" + "\t".join(sector for _, sector in labels), "region\tsector" + "\t" * size],
+        labels,
+        ((start, values * (column_scale / column_sums)) for start, values in tech_chunks()),  # column sums below 1
+    )
+
+    def bio_chunks():
+        for start, values in _get_chunks(seed, "S", (num_stressors, size), bio_density, -4, 3):
+            values[_get_rng([seed, start], "S-negative").random(values.shape) < 2e-5] *= -1
+            yield start, values
+
+    _write_table(
+        os.path.join(directory, "S.txt"),
+        ["region\t" + "\t".join(region for region, _ in labels), "sector\t" + "\t".join(sector for _, sector in labels), "stressor" + "\t" * size],
+        [(stressor,) for stressor in stressors],
+        bio_chunks(),
+    )
+
+    return [f"{region}-{sector}" for region, sector in labels], stressors
+
+
+def generate_cf_mapping(directory: str, stressors: list, num_emissions: int = 20, seed: int = 0) -> list:
+    """
+    Generate cf_mapping_file.csv for a selection of stressors.
+
+    Returns:
+        * list: Return the list of selected emissions.
+    """
+    rng = _get_rng(seed, "cf")
+    emissions = sorted(rng.choice(stressors, size=min(num_emissions, len(stressors)), replace=False).tolist())
+    pd.DataFrame({
+        "exiobase name": emissions,
+        "ecoinvent name": [f"ecoinvent {emission}" for emission in emissions],
+        "brightway code": [f"{i:08x}-0000-0000-0000-000000000000" for i in range(len(emissions))],
+        "CFs": np.round(rng.lognormal(1, 2, len(emissions)), 3),
+    }).to_csv(os.path.join(directory, "cf_mapping_file.csv"), index=False)
+
+    return emissions
+
+
+def generate_foreground(directory: str, bg_activities: list, emissions: list, num_activities: int = 10, exchanges_per_activity: int = 20, num_bg_columns: int = 10, seed: int = 0):
+    """
+    Generate foreground_system.csv and uncertainty_file.csv, in the format of the files in notebooks/data.
+
+    Every foreground activity has a production exchange, technosphere inputs from the background and from the previous foreground activity, and biosphere exchanges.
+    The uncertainty file has the same exchanges with uncertainty information, and the columnwise uncertainty of some background activities.
+
+    Parameters:
+        * directory: The directory to write the files.
+        * bg_activities: The list of background activities.
+        * emissions: The list of emissions.
+        * num_activities: The number of foreground activities.
+        * exchanges_per_activity: The number of background technosphere exchanges per foreground activity.
+        * num_bg_columns: The number of background activities with columnwise uncertainty.
+        * seed: The seed of the generator.
+    """
+    rng = _get_rng(seed, "fg")
+    rows = []
+    for i in range(num_activities):
+        activity = f"column_{i + 1}"
+        rows.append((activity, activity, "production", 1.0, 2, 0.0, False))
+        for exchange in rng.choice(bg_activities, size=min(exchanges_per_activity, len(bg_activities)), replace=False):
+            rows.append((activity, exchange, "technosphere", -float(f"{rng.lognormal(-8, 2):.4g}"), 2, round(rng.uniform(1.05, 3), 4), True))
+        if i > 0:
+            rows.append((activity, f"column_{i}", "technosphere", -float(f"{rng.uniform(0.1, 2):.4g}"), 2, round(rng.uniform(1.05, 1.5), 4), True))
+        for emission in rng.choice(emissions, size=min(3, len(emissions)), replace=False):
+            rows.append((activity, emission, "biosphere", float(f"{rng.lognormal(-3, 1):.4g}"), 2, round(rng.uniform(1.05, 1.5), 4), False))
+    columns = ["Activity name", "Exchange name", "Exchange type", "Exchange amount", "Exchange uncertainty type", "GSD", "Exchange negative"]
+    foreground = pd.DataFrame(rows, columns=columns)
+    foreground[columns[:4]].to_csv(os.path.join(directory, "foreground_system.csv"), index=False)
+
+    bg_rows = [(activity, activity, None, 1.0, 2, 0.0, False) for activity in rng.choice(bg_activities, size=min(num_bg_columns, len(bg_activities)), replace=False)]
+    pd.concat([foreground, pd.DataFrame(bg_rows, columns=columns)]).to_csv(os.path.join(directory, "uncertainty_file.csv"), index=False)
+
+
+def generate_dataset(directory: str, num_regions: int = 2, num_sectors: int = 38, num_stressors: int = 1113, tech_density: float = 0.03, bio_density: float = 0.4,
+                     num_emissions: int = 20, num_fg_activities: int = 10, exchanges_per_activity: int = 20, seed: int = 0) -> dict:
+    """
+    Generate all input files, the files are reused if the directory already has a dataset generated with the same arguments.
+
+    Returns:
+        * dict: Return the paths of the files and the arguments.
+    """
+    params = {key: value for key, value in locals().items() if key != "directory"}
+    files = {name: os.path.join(directory, name) for name in ["A.txt", "S.txt", "cf_mapping_file.csv", "foreground_system.csv", "uncertainty_file.csv"]}
+    params_file = os.path.join(directory, "params.json")
+    if os.path.exists(params_file) and all(os.path.exists(path) for path in files.values()):
+        with open(params_file, "r") as file:
+            if json.load(file) == params:
+                return {"files": files, "params": params}
+
+    bg_activities, stressors = generate_background(directory, num_regions, num_sectors, num_stressors, tech_density, bio_density, seed)
+    emissions = generate_cf_mapping(directory, stressors, num_emissions, seed)
+    generate_foreground(directory, bg_activities, emissions, num_fg_activities, exchanges_per_activity, seed=seed)
+    with open(params_file, "w") as file:
+        json.dump(params, file)
+
+    return {"files": files, "params": params}
@@ -0,0 +1,185 @@
+"""
+Benchmark every stage of the import-to-LCA pipeline on generated EXIOBASE-shaped data, and save the wall time, CPU time and peak memory of every stage to a JSON file.
+The stages are recorded with bamboo_lca.instrumentation, the JSON file also has the nested stages inside the package (depth > 0).
+
+Usage:
+    python benchmarks/pipeline_benchmark.py --size small --output results.json
+    python benchmarks/pipeline_benchmark.py --regions 49 --sectors 200 --output full.json
+
+Sizes: "small" (2 x 38 activities, dense like notebooks/data), "medium" (10 x 100, 5% non-zero), "full" (49 x 200 activities x 1113 stressors, 3% non-zero, like EXIOBASE 3).
+Two result files can be compared with: python benchmarks/pipeline_benchmark.py --compare old.json new.json
+With --trace trace.json, the stages are also saved in the Chrome trace format (chrome://tracing or https://ui.perfetto.dev).
+"""
+import argparse
+import platform
+import tempfile
+import warnings
+import time
+import json
+import sys
+import os
+from importlib import metadata
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from bamboo_lca.background_importer import BackgroundImporter
+from bamboo_lca.foreground_importer import ForegroundImporter
+from bamboo_lca.datapackage_builder import DatapackageBuilder
+from bamboo_lca.uncertainty_handler import UncertaintyHandler
+from bamboo_lca.uncertainty_importer import UncertaintyImporter
+from bamboo_lca.lca_wrapper import LCAWrapper, MonteCarloEngine
+from bamboo_lca.metadata_manager import UncertaintyMetadata
+from bamboo_lca.instrumentation import instrumentation, instrument
+from bamboo_lca.utils import *
+from generate_data import generate_dataset
+
+
+SIZES = {
+    "small": {"num_regions": 2, "num_sectors": 38, "tech_density": 0.95},
+    "medium": {"num_regions": 10, "num_sectors": 100, "tech_density": 0.05},
+    "full": {"num_regions": 49, "num_sectors": 200, "tech_density": 0.03},
+}
+
+
+def print_stage(record):
+    """
+    Print the wall time and the peak traced memory of every stage of the benchmark, the nested stages of the package are only saved.
+    """
+    if record["depth"] == 0:
+        print(f"{record['stage']:<32} {record['wall_seconds']:>10.3f} s {record['peak_memory_mb']:>10.1f} MB")
+
+
+def run_pipeline(files, iterations):
+    background = BackgroundImporter()
+    emissions = pd.read_csv(files["cf_mapping_file.csv"])["exiobase name"].tolist()
+
+    with instrumentation.stage("import_tech_matrix"):
+        tech_matrix, bg_activities = background.import_tech_matrix(files["A.txt"])
+    with instrumentation.stage("import_bio_matrix"):
+        bio_matrix = background.import_bio_matrix(files["S.txt"], emissions)
+    with instrumentation.stage("build_cf_matrix"):
+        cf_matrix = background.build_cf_matrix(files["cf_mapping_file.csv"], emissions)
+
+    foreground = ForegroundImporter()
+    with instrumentation.stage("extend_matrix"):
+        fg_activities = get_fg_activities(files["foreground_system.csv"], ",", bg_activities)
+        fg_df = get_fg_dataframe(pd.read_csv(files["foreground_system.csv"]), fg_activities)
+        fgbg, fgfg, bgfg, bifg = foreground.extend_matrix(fg_df, emissions, fg_activities, bg_activities, sparse_output=True)
+    with instrumentation.stage("concatenate_matrix"):
+        tech_matrix, bio_matrix = foreground.concatenate_matrix(tech_matrix, bio_matrix, fgbg, fgfg, bgfg, bifg)
+    activities = fg_activities + bg_activities
+
+    builder = DatapackageBuilder()
+    with instrumentation.stage("prepare_dp_matrix"):
+        datapackage_data = builder.prepare_dp_matrix(tech_matrix, bio_matrix, cf_matrix)
+    (tech_data, tech_indices, tech_flip), (bio_data, bio_indices), _ = datapackage_data
+
+    with instrumentation.stage("add_uniform_uncertainty"):
+        handler = UncertaintyHandler()
+        uniform = [handler.add_uniform_uncertainty(2, 1.106, False, tech_data, tech_flip), handler.add_uniform_uncertainty(2, 1.106, False, bio_data), None]
+    with instrumentation.stage("update_metadata_uncertainty"):
+        metadata = UncertaintyMetadata(activities)
+        UncertaintyImporter(files["uncertainty_file.csv"], ",", metadata).update_metadata_uncertainty(activities, "columnwise")
+    with instrumentation.stage("add_nonuniform_uncertainty"):
+        handler = UncertaintyHandler(metadata)
+        handler.add_nonuniform_uncertainty(tech_data, tech_indices, "columnwise", fg_num=len(fg_activities), fg_strategy="itemwise")
+        handler.add_nonuniform_uncertainty(bio_data, bio_indices, "columnwise", fg_num=len(fg_activities), fg_strategy="itemwise")
+
+    with instrumentation.stage("prepare_datapackage"):
+        datapackage = builder.prepare_datapackage(datapackage_data)
+    with instrumentation.stage("prepare_datapackage_uncertainty"):
+        uncertain_datapackage = builder.prepare_datapackage(datapackage_data, uniform)
+
+    wrapper = LCAWrapper()
+    index = 0  # the first foreground activity
+    with tempfile.TemporaryDirectory() as directory:
+        with instrumentation.stage("perform_static"):
+            wrapper.perform_static({index: 1}, datapackage, directory, "benchmark", "static", "fg")
+        with instrumentation.stage("perform_stochastic"):
+            wrapper.perform_stochastic(index, uncertain_datapackage, directory, "benchmark", "uniform", "fg", batch_size=iterations, num_batches=1, seed=0)
+
+    manual_tech_matrix = get_manual_tech_matrix(tech_matrix)
+    with instrumentation.stage("manual_lca"):
+        wrapper.manual_lca(manual_tech_matrix, bio_matrix, cf_matrix, index)
+    with instrumentation.stage("manual_lca_all"):
+        wrapper.manual_lca_all(manual_tech_matrix, bio_matrix, cf_matrix, activities)
+    with instrumentation.stage("monte_carlo_engine"):
+        MonteCarloEngine(datapackage_data, uniform).run(index, iterations, seed=0)
+
+
+def compare(old_file, new_file):
+    """
+    Print the relative change of every stage between two result files.
+    """
+    results = []
+    for file_path in [old_file, new_file]:
+        with open(file_path, "r") as file:
+            stages = pd.DataFrame(json.load(file)["stages"])
+        if "depth" in stages:  # only the stages of the benchmark, not the nested stages of the package
+            stages = stages[stages["depth"] == 0]
+        results.append(stages.set_index("stage"))
+    table = results[0][["wall_seconds", "peak_memory_mb"]].join(results[1][["wall_seconds", "peak_memory_mb"]], lsuffix="_old", rsuffix="_new", how="outer")
+    table["wall_change"] = table["wall_seconds_new"] / table["wall_seconds_old"] - 1
+    table["memory_change"] = table["peak_memory_mb_new"] / table["peak_memory_mb_old"] - 1
+    print(table.to_string(float_format=lambda value: f"{value:.3f}"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", choices=list(SIZES), default="small")
+    parser.add_argument("--regions", type=int, help="Overrides the number of regions of --size.")
+    parser.add_argument("--sectors", type=int, help="Overrides the number of sectors of --size.")
+    parser.add_argument("--stressors", type=int, default=1113)
+    parser.add_argument("--tech-density", type=float, help="Overrides the technosphere density of --size.")
+    parser.add_argument("--emissions", type=int, default=20, help="The number of emissions with characterization factors.")
+    parser.add_argument("--fg-activities", type=int, default=10)
+    parser.add_argument("--iterations", type=int, default=10, help="The number of Monte Carlo iterations.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-dir", help="The directory of the generated files, reused between runs. By default, a directory per size in the temp directory.")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--trace", help="Save the nested stages inside the package to this file, in the Chrome trace format.")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="Compare two result files instead of running the benchmark.")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    params = dict(SIZES[args.size])
+    for key, value in [("num_regions", args.regions), ("num_sectors", args.sectors), ("tech_density", args.tech_density)]:
+        if value is not None:
+            params[key] = value
+    params.update(num_stressors=args.stressors, num_emissions=args.emissions, num_fg_activities=args.fg_activities, seed=args.seed)
+    data_dir = args.data_dir or os.path.join(tempfile.gettempdir(), "bamboo_benchmark_" + "_".join(str(value) for value in params.values()))
+
+    start = time.perf_counter()
+    dataset = generate_dataset(data_dir, **params)
+    print(f"Data in {data_dir} ({time.perf_counter() - start:.1f} s)")
+
+    with instrument(trace_memory=True, callbacks=[print_stage]):
+        run_pipeline(dataset["files"], args.iterations)
+    if args.trace:
+        instrumentation.to_chrome_trace(args.trace)
+        print(f"Trace saved to {args.trace}.")
+
+    try:
+        version = metadata.version("bamboo_lca")
+    except metadata.PackageNotFoundError:
+        version = None
+    instrumentation.to_json(args.output, {
+        "bamboo_lca": version,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "iterations": args.iterations,
+        "dataset": dataset["params"],
+    })
+    print(f"Results saved to {args.output}.")
+
+
+if __name__ == "__main__":
+    warnings.filterwarnings("ignore", category=UserWarning)
+    main()
@@ -0,0 +1,93 @@
+"""
+Compare the sampling designs of MonteCarloEngine: how many iterations are needed to reach a target standard error of the mean lca score.
+
+The standard error of every design is measured over independent replicates, for a growing number of iterations.
+Usage: python benchmarks/sampling_benchmark.py [target relative standard error, default 0.005]
+"""
+import sys
+import os
+import time
+import warnings
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from bamboo_lca.background_importer import BackgroundImporter
+from bamboo_lca.foreground_importer import ForegroundImporter
+from bamboo_lca.datapackage_builder import DatapackageBuilder
+from bamboo_lca.uncertainty_handler import UncertaintyHandler
+from bamboo_lca.lca_wrapper import MonteCarloEngine
+from bamboo_lca.utils import *
+
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "..", "notebooks", "data")
+ACTIVITY = "RoW-Services"
+GSD = 1.106
+ITERATIONS = [16, 32, 64, 128, 256]
+REPLICATES = 30
+
+
+def build_engine_data():
+    """
+    Build the datapackage matrices of the example foreground system, with lognormal uncertainty on the technosphere and biosphere.
+    """
+    a_file, s_file = os.path.join(DATA_DIR, "A.txt"), os.path.join(DATA_DIR, "S.txt")
+    cf_file, fg_file = os.path.join(DATA_DIR, "cf_mapping_file.csv"), os.path.join(DATA_DIR, "foreground_system.csv")
+    emissions = pd.read_csv(cf_file)["exiobase name"].tolist()
+
+    background = BackgroundImporter()
+    tech_matrix, bio_matrix, bg_activities = background.import_background(a_file, s_file, emissions)
+    cf_matrix = background.build_cf_matrix(cf_file, emissions)
+
+    fg_activities = get_fg_activities(fg_file, ",", bg_activities)
+    fg_df = get_fg_dataframe(pd.read_csv(fg_file), fg_activities)
+    foreground = ForegroundImporter()
+    fgbg, fgfg, bgfg, bifg = foreground.extend_matrix(fg_df, emissions, fg_activities, bg_activities)
+    tech_matrix, bio_matrix = foreground.concatenate_matrix(tech_matrix, bio_matrix, fgbg, fgfg, bgfg, bifg)
+    datapackage_data = DatapackageBuilder().prepare_dp_matrix(tech_matrix, bio_matrix, cf_matrix)
+
+    (tech_data, _, tech_flip), (bio_data, _), _ = datapackage_data
+    handler = UncertaintyHandler()
+    uncertainty = [
+        handler.add_uniform_uncertainty(2, GSD, False, tech_data, tech_flip),
+        handler.add_uniform_uncertainty(2, GSD, False, bio_data),
+        None,
+    ]
+
+    return datapackage_data, uncertainty, (fg_activities + bg_activities).index(ACTIVITY)
+
+
+def main(target=5e-3):
+    datapackage_data, uncertainty, index = build_engine_data()
+    rows = []
+    for sampling in ["random", "lhs", "sobol"]:
+        engine = MonteCarloEngine(datapackage_data, uncertainty, sampling=sampling)
+        seeds = np.random.SeedSequence(42).spawn(REPLICATES)
+        for iterations in ITERATIONS:
+            start = time.perf_counter()
+            means = [engine.run(index, iterations, batch_size=iterations, seed=seed).mean() for seed in seeds]
+            rows.append({
+                "sampling": sampling,
+                "iterations": iterations,
+                "mean": np.mean(means),
+                "relative standard error": np.std(means, ddof=1) / abs(np.mean(means)),
+                "seconds per run": (time.perf_counter() - start) / REPLICATES,
+            })
+    results = pd.DataFrame(rows)
+    print(results.to_string(index=False))
+
+    # fit log(se) = a + b log(n) per design, and solve for the iterations that reach the target.
+    print(f"\nIterations needed for a relative standard error of {target}:")
+    needed = {}
+    for sampling, group in results.groupby("sampling", sort=False):
+        slope, intercept = np.polyfit(np.log(group["iterations"]), np.log(group["relative standard error"]), 1)
+        needed[sampling] = np.exp((np.log(target) - intercept) / slope)
+        extrapolated = not group["relative standard error"].min() <= target <= group["relative standard error"].max()
+        print(f"    {sampling}: {needed[sampling]:.0f}{' (extrapolated)' if extrapolated else ''}, standard error ~ n^{slope:.2f}, {needed['random'] / needed[sampling]:.1f}x fewer than random")
+
+    return results
+
+
+if __name__ == "__main__":
+    warnings.filterwarnings("ignore", category=UserWarning)  # balance warnings of Sobol
+    main(float(sys.argv[1]) if len(sys.argv) > 1 else 5e-3)
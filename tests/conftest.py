@@ -0,0 +1,42 @@
+import pandas as pd
+import pytest
+import os
+from bamboo_lca.background_importer import BackgroundImporter
+from bamboo_lca.foreground_importer import ForegroundImporter
+from bamboo_lca.utils import *
+
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "..", "notebooks", "data")
+
+
+@pytest.fixture(scope="session")
+def system():
+    """
+    The background, foreground and full system of notebooks/data, the same steps as the notebooks.
+    """
+    a_file, s_file = os.path.join(DATA_DIR, "A.txt"), os.path.join(DATA_DIR, "S.txt")
+    cf_file, fg_file = os.path.join(DATA_DIR, "cf_mapping_file.csv"), os.path.join(DATA_DIR, "foreground_system.csv")
+    emissions = pd.read_csv(cf_file)["exiobase name"].tolist()
+
+    background = BackgroundImporter()
+    tech_matrix, bg_activities = background.import_tech_matrix(a_file)
+    bio_matrix = background.import_bio_matrix(s_file, emissions)
+    cf_matrix = background.build_cf_matrix(cf_file, emissions)
+
+    fg_activities = get_fg_activities(fg_file, ",", bg_activities)
+    fg_df = get_fg_dataframe(pd.read_csv(fg_file), fg_activities)
+    foreground = ForegroundImporter()
+    fgbg, fgfg, bgfg, bifg = foreground.extend_matrix(fg_df, emissions, fg_activities, bg_activities, sparse_output=True)
+    full_tech_matrix, full_bio_matrix = foreground.concatenate_matrix(tech_matrix, bio_matrix, fgbg, fgfg, bgfg, bifg)
+
+    return {
+        "tech_matrix": tech_matrix,
+        "bio_matrix": bio_matrix,
+        "cf_matrix": cf_matrix,
+        "foreground": (fgbg, fgfg, bgfg, bifg),
+        "full_tech_matrix": full_tech_matrix,
+        "full_bio_matrix": full_bio_matrix,
+        "manual_tech_matrix": get_manual_tech_matrix(full_tech_matrix),
+        "fg_activities": fg_activities,
+        "activities": fg_activities + bg_activities,
+    }
@@ -0,0 +1,66 @@
+from scipy import sparse
+import numpy as np
+import pytest
+from bamboo_lca.foreground_importer import ForegroundImporter
+from bamboo_lca.uncertainty_handler import UncertaintyHandler
+from bamboo_lca.lca_wrapper import LCAWrapper
+from bamboo_lca.foreground_solver import ForegroundSolver
+from bamboo_lca.utils import get_manual_tech_matrix, sample_uncertainty
+
+
+@pytest.fixture(scope="module")
+def solver(system):
+    solver = ForegroundSolver(system["tech_matrix"], system["bio_matrix"], system["cf_matrix"])
+    solver.set_foreground(*system["foreground"])
+
+    return solver
+
+
+def _full_system_score(system, fgbg, fgfg, bgfg, bifg, index):
+    tech_matrix, bio_matrix = ForegroundImporter().concatenate_matrix(system["tech_matrix"], system["bio_matrix"], fgbg, fgfg, bgfg, bifg)
+
+    return LCAWrapper().manual_lca(get_manual_tech_matrix(tech_matrix), bio_matrix, system["cf_matrix"], index)
+
+
+def test_score_matches_manual_lca(system, solver):
+    for index in [0, len(system["fg_activities"]) - 1, len(system["fg_activities"]), len(system["activities"]) - 1]:
+        expected = LCAWrapper().manual_lca(system["manual_tech_matrix"], system["full_bio_matrix"], system["cf_matrix"], index)
+        assert solver.score(index) == pytest.approx(expected, rel=1e-8)
+
+
+def test_scores_match_manual_lca_all(system, solver):
+    expected = LCAWrapper().manual_lca_all(system["manual_tech_matrix"], system["full_bio_matrix"], system["cf_matrix"], system["activities"])
+    assert np.allclose(solver.scores(), expected.iloc[:len(system["fg_activities"])], rtol=1e-8)
+
+
+def test_score_with_fgbg_and_foreground_emissions(system):
+    fgbg, fgfg, bgfg, bifg = system["foreground"]
+    fgbg, bifg = fgbg.tolil(), bifg.tolil()
+    fgbg[0, 5], fgbg[2, 40] = 0.1, 0.05
+    bifg[0, 0], bifg[3, 1] = 2.0, 0.5
+    fgbg, bifg = sparse.csr_array(fgbg), sparse.csr_array(bifg)
+
+    solver = ForegroundSolver(system["tech_matrix"], system["bio_matrix"], system["cf_matrix"])
+    solver.set_foreground(fgbg, fgfg, bgfg, bifg)
+    for index in [0, 2, len(system["fg_activities"]) + 5]:
+        assert solver.score(index) == pytest.approx(_full_system_score(system, fgbg, fgfg, bgfg, bifg, index), rel=1e-8)
+    num_fg = len(system["fg_activities"])
+    assert np.allclose(solver.scores(), [_full_system_score(system, fgbg, fgfg, bgfg, bifg, i) for i in range(num_fg)], rtol=1e-8)
+
+
+def test_run_matches_manual_lca(system, solver):
+    fgbg, fgfg, bgfg, bifg = system["foreground"]
+    handler = UncertaintyHandler()
+    uncertainty = {"fgfg": handler.add_uniform_uncertainty(2, 1.106, False, solver.blocks["fgfg"].data), "bgfg": handler.add_uniform_uncertainty(2, 1.106, False, solver.blocks["bgfg"].data)}
+    scores = solver.run(0, 4, uncertainty, seed=7)
+
+    # sample the same values as run, and solve the full system with them.
+    rng = np.random.default_rng(7)
+    samples = {name: sample_uncertainty(params, rng.random((4, len(params)))) for name, params in uncertainty.items()}
+    for i in range(4):
+        blocks = {}
+        for name in ["fgfg", "bgfg"]:
+            blocks[name] = solver.blocks[name].copy()
+            blocks[name].data = samples[name][i]
+        assert scores[i] == pytest.approx(_full_system_score(system, fgbg, blocks["fgfg"], blocks["bgfg"], bifg, 0), rel=1e-8)
+    assert np.std(scores) > 0
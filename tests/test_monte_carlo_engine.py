@@ -0,0 +1,70 @@
+from scipy.sparse import linalg
+from scipy import sparse
+import bw_processing as bwp
+import numpy as np
+import pytest
+from bamboo_lca.datapackage_builder import DatapackageBuilder
+from bamboo_lca.uncertainty_handler import UncertaintyHandler
+from bamboo_lca.result_writer import ResultWriter
+from bamboo_lca.lca_wrapper import LCAWrapper, MonteCarloEngine
+from bamboo_lca.utils import get_manual_tech_matrix
+
+
+@pytest.fixture(scope="module")
+def datapackage_data(system):
+    return DatapackageBuilder().prepare_dp_matrix(system["full_tech_matrix"], system["full_bio_matrix"], system["cf_matrix"])
+
+
+def test_static_scores_match_manual_lca(system, datapackage_data):
+    engine = MonteCarloEngine(datapackage_data, None)
+    for index in [0, len(system["fg_activities"]), len(system["activities"]) - 1]:
+        expected = LCAWrapper().manual_lca(system["manual_tech_matrix"], system["full_bio_matrix"], system["cf_matrix"], index)
+        scores = engine.run(index, 3, seed=0)
+        assert np.allclose(scores, expected, rtol=1e-8)
+
+
+@pytest.mark.parametrize("sampling", ["random", "lhs", "sobol"])
+def test_sampled_scores_match_direct_solve(tmp_path, datapackage_data, sampling):
+    (tech_data, _, tech_flip), (bio_data, _), _ = datapackage_data
+    handler = UncertaintyHandler()
+    uncertainty = [handler.add_uniform_uncertainty(2, 1.106, False, tech_data, tech_flip), handler.add_uniform_uncertainty(2, 1.106, False, bio_data), None]
+    engine = MonteCarloEngine(datapackage_data, uncertainty, sampling=sampling)
+    index = 0
+
+    writer = ResultWriter(str(tmp_path))
+    scores = engine.run(index, 8, batch_size=8, seed=42, writer=writer)
+
+    # rebuild every iteration from the stored batch seed, and solve it directly instead of with the preconditioned GMRES.
+    engine._sobol = None
+    samples = engine.sample(8, np.random.default_rng(int(ResultWriter.load(str(tmp_path))["seed"][0])))
+    demand = np.zeros(len(engine.activity_ids))
+    demand[index] = 1
+    for i in range(8):
+        tech_matrix, bio_matrix, cf_matrix = [engine._get_matrix(name, samples, i) for name in engine.matrices]
+        expected = np.sum(cf_matrix @ (bio_matrix @ linalg.spsolve(sparse.csc_array(tech_matrix), demand)))
+        # GMRES stops at rtol=1e-10 on the technosphere residual, the large biosphere and characterization factors amplify it to about 1e-7 in the score.
+        assert scores[i] == pytest.approx(expected, rel=1e-6)
+    assert np.std(scores) > 0
+
+
+def test_fixed_values_use_loc(system, datapackage_data):
+    (tech_data, tech_indices, tech_flip), _, _ = datapackage_data
+    # fixed (type 0) technosphere values, one of them at another loc than its data.
+    uncertainty = np.zeros(len(tech_data), dtype=bwp.UNCERTAINTY_DTYPE)
+    uncertainty["loc"] = tech_data
+    changed = np.flatnonzero(tech_flip)[0]
+    uncertainty["loc"][changed] *= 2
+    engine = MonteCarloEngine(datapackage_data, [uncertainty, None, None])
+
+    # loc is float32 in bwp.UNCERTAINTY_DTYPE, so the expected technosphere is built from the stored loc values.
+    tech_matrix = sparse.csr_array((uncertainty["loc"].astype(float), (tech_indices["row"], tech_indices["col"])), shape=system["full_tech_matrix"].shape)
+    index = int(tech_indices["col"][changed])
+    expected = LCAWrapper().manual_lca(get_manual_tech_matrix(tech_matrix), system["full_bio_matrix"], system["cf_matrix"], index)
+    assert expected != pytest.approx(LCAWrapper().manual_lca(system["manual_tech_matrix"], system["full_bio_matrix"], system["cf_matrix"], index), rel=1e-8)
+    assert np.allclose(engine.run(index, 2, seed=0), expected, rtol=1e-8)
+
+
+def test_unknown_activity(datapackage_data):
+    engine = MonteCarloEngine(datapackage_data, None)
+    with pytest.raises(ValueError):
+        engine.run(len(engine.activity_ids), 2)
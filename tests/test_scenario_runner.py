@@ -0,0 +1,43 @@
+from scipy import sparse
+import pytest
+from bamboo_lca.lca_wrapper import LCAWrapper
+from bamboo_lca.scenario_runner import ScenarioRunner
+
+
+TECHNOSPHERE_PATCH = [(5, 0, -0.3), (10, 3, -0.02), (3, 3, 0.98), (40, 20, -0.1)]
+BIOSPHERE_PATCH = [(0, 0, 5.0), (2, 10, 1e5)]
+
+
+def _patch(matrix, entries):
+    matrix = sparse.lil_array(matrix)
+    for row, col, value in entries:
+        matrix[row, col] = value
+
+    return sparse.csr_array(matrix)
+
+
+@pytest.mark.parametrize("max_rank", [20, 0])
+def test_technosphere_patch_matches_manual_lca(system, max_rank):
+    runner = ScenarioRunner(system["manual_tech_matrix"], system["full_bio_matrix"], system["cf_matrix"], 0, max_rank=max_rank)
+    expected = LCAWrapper().manual_lca(_patch(system["manual_tech_matrix"], TECHNOSPHERE_PATCH), system["full_bio_matrix"], system["cf_matrix"], 0)
+    assert runner.evaluate({"technosphere": TECHNOSPHERE_PATCH})["score"] == pytest.approx(expected, rel=1e-8)
+
+
+def test_biosphere_patch_matches_manual_lca(system):
+    runner = ScenarioRunner(system["manual_tech_matrix"], system["full_bio_matrix"], system["cf_matrix"], 0)
+    patch = {"technosphere": TECHNOSPHERE_PATCH, "biosphere": BIOSPHERE_PATCH}
+    expected = LCAWrapper().manual_lca(_patch(system["manual_tech_matrix"], TECHNOSPHERE_PATCH), _patch(system["full_bio_matrix"], BIOSPHERE_PATCH), system["cf_matrix"], 0)
+    assert runner.evaluate(patch)["score"] == pytest.approx(expected, rel=1e-8)
+
+
+def test_run_matches_manual_lca(system):
+    index = len(system["fg_activities"]) + 3
+    runner = ScenarioRunner(system["manual_tech_matrix"], system["full_bio_matrix"], {"single": system["cf_matrix"], "double": 2 * system["cf_matrix"]}, index)
+    results = runner.run({"patched": {"technosphere": TECHNOSPHERE_PATCH}})
+
+    base = LCAWrapper().manual_lca(system["manual_tech_matrix"], system["full_bio_matrix"], system["cf_matrix"], index)
+    patched = LCAWrapper().manual_lca(_patch(system["manual_tech_matrix"], TECHNOSPHERE_PATCH), system["full_bio_matrix"], system["cf_matrix"], index)
+    assert list(results.index) == ["base", "patched"]
+    assert results.loc["base", "single"] == pytest.approx(base, rel=1e-8)
+    assert results.loc["base", "double"] == pytest.approx(2 * base, rel=1e-8)
+    assert results.loc["patched", "single"] == pytest.approx(patched, rel=1e-8)
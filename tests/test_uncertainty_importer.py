@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+import os
+from bamboo_lca.datapackage_builder import DatapackageBuilder
+from bamboo_lca.uncertainty_handler import UncertaintyHandler
+from bamboo_lca.uncertainty_importer import UncertaintyImporter
+from bamboo_lca.metadata_manager import UncertaintyMetadata
+from conftest import DATA_DIR
+
+
+UNCERTAINTY_FILE = os.path.join(DATA_DIR, "uncertainty_file.csv")
+
+
+def _get_uncertainty(system, metadata):
+    (tech_data, tech_indices, _), _, _ = DatapackageBuilder().prepare_dp_matrix(system["full_tech_matrix"], system["full_bio_matrix"], system["cf_matrix"])
+
+    return UncertaintyHandler(metadata).add_nonuniform_uncertainty(tech_data, tech_indices, "columnwise", fg_num=len(system["fg_activities"]), fg_strategy="itemwise")
+
+
+def _assert_same_uncertainty(actual, expected):
+    for name in ["uncertainty_type", "loc", "scale", "negative"]:
+        assert np.allclose(actual[name], expected[name], equal_nan=True), name
+
+
+@pytest.mark.parametrize("strategy", ["itemwise", "columnwise"])
+def test_uncertainty_metadata_matches_dictionary(system, strategy):
+    metadata = {}
+    UncertaintyImporter(UNCERTAINTY_FILE, ",", metadata).update_metadata_uncertainty(system["activities"], strategy)
+    store = UncertaintyMetadata(system["activities"])
+    UncertaintyImporter(UNCERTAINTY_FILE, ",", store).update_metadata_uncertainty(system["activities"], strategy)
+
+    assert store.uncertainty_type.any()
+    _assert_same_uncertainty(_get_uncertainty(system, store), _get_uncertainty(system, metadata))
+
+
+def test_other_model_does_not_inherit_metadata(system):
+    metadata = {}
+    UncertaintyImporter(UNCERTAINTY_FILE, ",", metadata).update_metadata_uncertainty(system["activities"], "itemwise")
+
+    # a second model with other activities, none of them is in the uncertainty file.
+    activities = [f"other {activity}" for activity in system["activities"]]
+    UncertaintyImporter(UNCERTAINTY_FILE, ",", metadata).update_metadata_uncertainty(activities, "itemwise")
+    assert [metadata[i] for i in range(len(metadata))] == [{"Activity name": activity} for activity in activities]
+
+
+def test_uncertainty_metadata_with_other_activities(system):
+    store = UncertaintyMetadata(system["activities"][::-1])
+    with pytest.raises(ValueError):
+        UncertaintyImporter(UNCERTAINTY_FILE, ",", store).update_metadata_uncertainty(system["activities"], "columnwise")
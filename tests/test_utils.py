@@ -0,0 +1,23 @@
+import bw_processing as bwp
+import numpy as np
+import pytest
+from bamboo_lca.utils import add_pedigree_uncertainty
+
+
+def _get_indices(rows, cols):
+    return np.array(list(zip(rows, cols)), dtype=bwp.INDICES_DTYPE)
+
+
+def test_specific_gsd_is_looked_up_by_row():
+    # column 1 only has exchanges in rows 0 and 3, so it takes the GSDs of rows 0 and 3.
+    indices = _get_indices([0, 1, 0, 3], [0, 0, 1, 1])
+    uncertainty = add_pedigree_uncertainty(np.array([1.0, 0.5, 0.2, 0.3]), indices, [1.5, np.nan], specific_gsd={1: [1.1, 1.2, 1.3, 1.4]})
+
+    assert uncertainty["uncertainty_type"].tolist() == [2, 2, 2, 2]
+    assert np.allclose(uncertainty["scale"], np.log([1.5, 1.5, 1.1, 1.4]))
+
+
+def test_specific_gsd_missing_rows():
+    indices = _get_indices([0, 3], [1, 1])
+    with pytest.raises(ValueError):
+        add_pedigree_uncertainty(np.array([0.2, 0.3]), indices, [np.nan, np.nan], specific_gsd={1: [1.1, 1.2]})